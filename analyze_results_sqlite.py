@@ -4,13 +4,290 @@ import matplotlib.pyplot as plt
 from fpdf import FPDF
 from io import BytesIO
 from pathlib import Path
+from datetime import datetime, time, timedelta
+from time import perf_counter
+from collections import deque
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import json
+import math
+import os
+import re
+import zlib
 
 # Ruta absoluta y estable a la BD, junto al script
 BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = str(BASE_DIR / "results.db")
+ARCHIVE_DB_PATH = str(BASE_DIR / "results_archive.db")
 PDF_FILE = str(BASE_DIR / "reporte_estadisticas.pdf")
 
+# Columnas que lee load_data (answers_json solo bajo demanda)
+RESULT_COLUMNS = (
+    "id", "student_id", "exam_id", "correct_count", "incorrect_count", "percent_correct",
+    "answered_count", "omitted_count", "timestamp", "ts_epoch",
+)
+INT_COLUMNS = ("id", "correct_count", "incorrect_count", "answered_count", "omitted_count")
+
+# ---------- Codificación compacta de answers_json ----------
+# Formato empaquetado (v1): en lugar de una lista de objetos con claves repetidas
+#   [{"q": 1, "studentValue": "A", "correctValue": "C", "isCorrect": false}, ...]
+# se guarda un objeto con arreglos paralelos:
+#   {"v": 1, "q": [1, ...], "s": "A...", "c": "C...", "k": "0..."}
+# s/c son strings de un carácter por pregunta (" " = sin valor) cuando todos los
+# valores son de un carácter; si no, se guardan como listas. k usa "1"/"0"/" ".
+# Con compresión, se guarda como BLOB: prefijo mágico + zlib(json).
+# Si alguna respuesta trae claves desconocidas se guarda la lista JSON original
+# (comprimida), para no perder información.
+ANSWERS_COMPRESS = True
+_PACKED_MAGIC = b"AZP1"
+_JSON_MAGIC = b"AZJ1"
+_EMPTY_CODE = " "
+_ANSWER_KEYS = {"q", "question", "value", "studentValue", "correctValue", "isCorrect"}
+# Forma de exportación y de normalize_result (las 4 claves, sin alias): camino
+# rápido de _pack_answers, que la transpone en C con itemgetter/zip
+_EXPORT_KEYS = ("q", "studentValue", "correctValue", "isCorrect")
+_export_values = itemgetter(*_EXPORT_KEYS)
+_CORRECT_CODES = {None: _EMPTY_CODE, True: "1", False: "0"}
+_CORRECT_TYPES = {bool, type(None)}
+# zlib con ventana y memoria chicas: los payloads son de cientos de bytes y el
+# costo lo domina reservar/inicializar la ventana por defecto (32 KB + hash),
+# no el nivel. El BLOB resultante es zlib estándar (decompress lo lee igual).
+_ZLIB_LEVEL = 6
+_ZLIB_WBITS = 12
+_ZLIB_MEMLEVEL = 2
+
+def _compress(data: bytes) -> bytes:
+    c = zlib.compressobj(_ZLIB_LEVEL, zlib.DEFLATED, _ZLIB_WBITS, _ZLIB_MEMLEVEL)
+    return c.compress(data) + c.flush()
+
+def _pack_chars(values: list):
+    # Equivale a: todos None o str de 1 carácter distinto de _EMPTY_CODE,
+    # resuelto con join/len/count en C en lugar de un generador por valor.
+    chars = [_EMPTY_CODE if v is None else v for v in values]
+    try:
+        joined = "".join(chars)
+    except TypeError:
+        return list(values)
+    if (len(joined) == len(chars) and (not chars or max(map(len, chars)) == 1)
+            and joined.count(_EMPTY_CODE) == values.count(None)):
+        return joined
+    return list(values)
+
+def _unpack_chars(packed):
+    if isinstance(packed, str):
+        return [None if ch == _EMPTY_CODE else ch for ch in packed]
+    return list(packed)
+
+def _pack_answers(answers: list):
+    """Devuelve el dict empaquetado o None si las respuestas no son empaquetables."""
+    try:
+        # KeyError/TypeError si falta alguna clave o no son dicts; len 4 = sin claves extra
+        qs, sv, cv, ics = zip(*map(_export_values, answers))
+        fast = set(map(len, answers)) == {4} and set(map(type, ics)) <= _CORRECT_TYPES
+    except (KeyError, TypeError, ValueError):
+        fast = False
+    if fast:
+        return {"v": 1, "q": list(qs), "s": _pack_chars(list(sv)), "c": _pack_chars(list(cv)),
+                "k": "".join([_CORRECT_CODES[ic] for ic in ics])}
+    qs, sv, cv, ks = [], [], [], []
+    for a in answers:
+        if not isinstance(a, dict) or not set(a) <= _ANSWER_KEYS:
+            return None
+        if ("q" in a and "question" in a) or ("value" in a and "studentValue" in a):
+            return None
+        ic = a.get("isCorrect")
+        if ic is not None and not isinstance(ic, bool):
+            return None
+        qs.append(a.get("q", a.get("question")))
+        sv.append(a.get("studentValue", a.get("value")))
+        cv.append(a.get("correctValue"))
+        ks.append(_EMPTY_CODE if ic is None else ("1" if ic else "0"))
+    return {"v": 1, "q": qs, "s": _pack_chars(sv), "c": _pack_chars(cv), "k": "".join(ks)}
+
+def _unpack_answers(packed: dict) -> list:
+    qs = packed.get("q") or []
+    sv = _unpack_chars(packed.get("s") or [])
+    cv = _unpack_chars(packed.get("c") or [])
+    ks = packed.get("k") or ""
+    return [
+        {"q": q, "studentValue": s, "correctValue": c,
+         "isCorrect": None if k == _EMPTY_CODE else k == "1"}
+        for q, s, c, k in zip(qs, sv, cv, ks)
+    ]
+
+def encode_answers(answers, compress: bool = ANSWERS_COMPRESS):
+    """
+    Codifica la lista de respuestas por pregunta para guardarla en answers_json.
+    Acepta la lista o su JSON (texto). Devuelve bytes (compress=True) o texto.
+    Un BLOB ya codificado se devuelve tal cual (normalize_result ya lo codifica).
+    """
+    if answers is None:
+        return None
+    if compress and isinstance(answers, bytes) and answers[:4] in (_PACKED_MAGIC, _JSON_MAGIC):
+        return answers
+    if isinstance(answers, (bytes, str)):
+        try:
+            answers = decode_answers(answers)
+        except (ValueError, zlib.error):
+            return answers  # texto no interpretable: se guarda tal cual
+    answers = list(answers or [])
+    packed = _pack_answers(answers)
+    payload = packed if packed is not None else answers
+    text = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    if not compress:
+        return text
+    raw = text.encode("utf-8")
+    magic = _PACKED_MAGIC if packed is not None else _JSON_MAGIC
+    blob = magic + _compress(raw)
+    # Listas muy cortas no ganan nada comprimiéndose
+    return blob if len(blob) < len(raw) else text
+
+def _load_stored(raw):
+    """Texto/BLOB almacenado -> objeto JSON (lista original o dict empaquetado)."""
+    if raw is None:
+        return []
+    if isinstance(raw, (list, dict)):
+        return raw
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        raw = bytes(raw)
+        magic, body = raw[:4], raw[4:]
+        if magic in (_PACKED_MAGIC, _JSON_MAGIC):
+            raw = zlib.decompress(body).decode("utf-8")
+        else:
+            raw = raw.decode("utf-8")
+    if isinstance(raw, float):  # NaN de pandas
+        return []
+    raw = str(raw).strip()
+    if not raw:
+        return []
+    return json.loads(raw)
+
+def _is_packed(obj) -> bool:
+    return isinstance(obj, dict) and obj.get("v") == 1
+
+def decode_answers(raw) -> list:
+    """
+    Decodifica answers_json en cualquiera de sus formatos (JSON original,
+    empaquetado en texto o BLOB comprimido) a una lista de dicts.
+    """
+    obj = _load_stored(raw)
+    if _is_packed(obj):
+        return _unpack_answers(obj)
+    return obj or []
+
+def decode_answers_columns(raw) -> dict:
+    """
+    Como decode_answers, pero devuelve columnas paralelas
+    {"q", "studentValue", "correctValue", "isCorrect"} sin construir un dict por
+    pregunta (el formato empaquetado ya está en columnas).
+    """
+    obj = _load_stored(raw)
+    if _is_packed(obj):
+        ks = obj.get("k") or ""
+        return {
+            "q": list(obj.get("q") or []),
+            "studentValue": _unpack_chars(obj.get("s") or []),
+            "correctValue": _unpack_chars(obj.get("c") or []),
+            "isCorrect": [None if k == _EMPTY_CODE else k == "1" for k in ks],
+        }
+    arr = [a for a in (obj or []) if isinstance(a, dict)]
+    return {
+        "q": [a.get("q") or a.get("question") for a in arr],
+        "studentValue": [a.get("value") or a.get("studentValue") for a in arr],
+        "correctValue": [a.get("correctValue") for a in arr],
+        "isCorrect": [a.get("isCorrect") for a in arr],
+    }
+
+def answers_to_json(raw) -> str:
+    """answers_json en el formato JSON original (para mostrar/exportar)."""
+    return json.dumps(decode_answers(raw), ensure_ascii=False)
+
+def _answers_to_json_safe(raw):
+    try:
+        return answers_to_json(raw)
+    except (ValueError, zlib.error):
+        return raw if isinstance(raw, str) else None
+
+def compact_answers(db_path: str = DB_PATH, compress: bool = ANSWERS_COMPRESS, batch_size: int = 5000) -> int:
+    """
+    Migra a formato compacto las filas cuyo answers_json sigue como JSON de texto.
+    Devuelve cuántas filas se convirtieron.
+    """
+    conn = sqlite3.connect(db_path)
+    converted = _compact_answers(conn, compress, batch_size)
+    conn.commit()
+    conn.close()
+    return converted
+
+def _compact_answers(conn, compress: bool = ANSWERS_COMPRESS, batch_size: int = 5000) -> int:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, answers_json FROM exam_results
+        WHERE typeof(answers_json) = 'text' AND answers_json LIKE '[%';
+    """)
+    converted = 0
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        updates = []
+        for rid, aj in rows:
+            try:
+                new = encode_answers(aj, compress)
+            except (ValueError, TypeError):
+                continue
+            # Sin formato empaquetado posible (y sin comprimir) sigue siendo JSON
+            # de texto: no se reescribe ni se cuenta como convertida.
+            if new == aj or (isinstance(new, str) and new.lstrip().startswith("[")):
+                continue
+            updates.append((new, rid))
+        conn.executemany("UPDATE exam_results SET answers_json = ? WHERE id = ?;", updates)
+        converted += len(updates)
+    return converted
+
+def _legacy_columns(text: str) -> dict:
+    # Decodificación del JSON original tal como la hacía explode_answers
+    arr = json.loads(text) or []
+    return {
+        "q": [a.get("q") or a.get("question") for a in arr],
+        "studentValue": [a.get("value") or a.get("studentValue") for a in arr],
+        "correctValue": [a.get("correctValue") for a in arr],
+        "isCorrect": [a.get("isCorrect") for a in arr],
+    }
+
+def answers_storage_report(db_path: str = DB_PATH, sample: int = 2000) -> dict:
+    """
+    Compara bytes almacenados y tiempo de decodificación de answers_json
+    entre el JSON original y el formato compacto (sobre una muestra de filas).
+    """
+    conn = sqlite3.connect(db_path)
+    rows = [r[0] for r in conn.execute(
+        "SELECT answers_json FROM exam_results WHERE answers_json IS NOT NULL LIMIT ?;", (sample,)
+    )]
+    conn.close()
+    decoded = [decode_answers(r) for r in rows]
+    original = [json.dumps(a) for a in decoded]
+    compact = [encode_answers(a) for a in decoded]
+
+    def _timed(items, fn):
+        t0 = perf_counter()
+        for it in items:
+            fn(it)
+        return perf_counter() - t0
+
+    bytes_original = sum(len(o.encode("utf-8")) for o in original)
+    bytes_compact = sum(len(c) for c in compact)
+    t_original = _timed(original, _legacy_columns)
+    t_compact = _timed(compact, decode_answers_columns)
+    return {
+        "filas": len(rows),
+        "bytes JSON original": bytes_original,
+        "bytes compacto": bytes_compact,
+        "reducción tamaño (x)": round(bytes_original / bytes_compact, 2) if bytes_compact else 0.0,
+        "decodificación JSON original (ms)": round(t_original * 1000, 2),
+        "decodificación compacto (ms)": round(t_compact * 1000, 2),
+    }
+
 # ---------- Inicialización y migraciones ----------
 def _column_exists(conn, table, col):
     cur = conn.cursor()
@@ -18,6 +295,54 @@ def _column_exists(conn, table, col):
     cols = [r[1] for r in cur.fetchall()]
     return col in cols
 
+def _to_epoch(ts) -> int:
+    """
+    Convierte un timestamp ISO (texto) a segundos epoch (int).
+    Los timestamps sin zona se interpretan en hora local, igual que datetime.now().
+    Devuelve None si el texto no se puede interpretar.
+    """
+    if ts is None:
+        return None
+    try:
+        return int(datetime.fromisoformat(str(ts).strip()).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def _to_epoch_ms(ts) -> int:
+    """Como _to_epoch, en milisegundos (_to_epoch_ms(ts) // 1000 == _to_epoch(ts))."""
+    if ts is None:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(ts).strip())
+    except (TypeError, ValueError):
+        return None
+    return int(dt.timestamp()) * 1000 + dt.microsecond // 1000
+
+def _backfill_ts_epoch(conn) -> int:
+    """Completa ts_epoch desde timestamp. Devuelve cuántas filas no se pudieron convertir."""
+    cur = conn.cursor()
+    cur.execute("SELECT id, timestamp FROM exam_results WHERE ts_epoch IS NULL;")
+    pending = [(_to_epoch(ts), rid) for rid, ts in cur.fetchall()]
+    converted = [(ep, rid) for ep, rid in pending if ep is not None]
+    if converted:
+        cur.executemany("UPDATE exam_results SET ts_epoch = ? WHERE id = ?;", converted)
+    return len(pending) - len(converted)
+
+def missing_epoch_rows(db_path: str = DB_PATH) -> list:
+    """
+    (id, timestamp) de las filas sin ts_epoch (timestamp no interpretable).
+    Quedan fuera de los filtros por fecha y al final del orden por fecha.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT id, timestamp FROM exam_results WHERE ts_epoch IS NULL ORDER BY id;"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
 def init_db(db_path: str = DB_PATH):
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
@@ -52,6 +377,74 @@ def init_db(db_path: str = DB_PATH):
             cur.execute("ALTER TABLE exam_results ADD COLUMN answers_json TEXT;")
         except Exception:
             pass
+    # ts_epoch: segundos epoch (INTEGER) para filtros por rango y orden.
+    # 'timestamp' (TEXT ISO) se mantiene para mostrar.
+    if not _column_exists(conn, "exam_results", "ts_epoch"):
+        try:
+            cur.execute("ALTER TABLE exam_results ADD COLUMN ts_epoch INTEGER;")
+        except Exception:
+            pass
+    # ingest_key: clave de idempotencia de la ingesta directa (ver normalize_result)
+    if not _column_exists(conn, "exam_results", "ingest_key"):
+        try:
+            cur.execute("ALTER TABLE exam_results ADD COLUMN ingest_key TEXT;")
+        except Exception:
+            pass
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_exam_results_exam_ts ON exam_results (exam_id, ts_epoch);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_exam_results_ts ON exam_results (ts_epoch);")
+
+    # Agregados por examen y mes de los resultados ya archivados (ver aplicar_retencion)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS exam_aggregates (
+        exam_id TEXT NOT NULL,
+        period TEXT NOT NULL,
+        n_results INTEGER DEFAULT 0,
+        sum_percent REAL DEFAULT 0.0,
+        min_percent REAL,
+        max_percent REAL,
+        sum_correct INTEGER DEFAULT 0,
+        sum_incorrect INTEGER DEFAULT 0,
+        first_epoch INTEGER,
+        last_epoch INTEGER,
+        PRIMARY KEY (exam_id, period)
+    );
+    """)
+
+    # v1: answers_json en formato compacto (una sola vez por BD)
+    version = cur.execute("PRAGMA user_version;").fetchone()[0]
+    if version < 1:
+        _compact_answers(conn)
+        cur.execute("PRAGMA user_version = 1;")
+    # v2: ts_epoch de las filas anteriores a la columna (las nuevas ya lo traen
+    # desde insert_results/importar_resultados), una sola vez por BD
+    if version < 2:
+        failed = _backfill_ts_epoch(conn)
+        if failed:
+            print(f"⚠️ {failed} filas con timestamp no interpretable quedaron sin ts_epoch "
+                  f"(ver missing_epoch_rows / --sin-epoch).")
+        cur.execute("PRAGMA user_version = 2;")
+    # v3: contador de borrados; junto con MAX(id) forma el token de cambios de
+    # results_version() (MAX(id) solo detecta inserciones). Va en la migración
+    # porque el INSERT toma el lock de escritura: las lecturas que llaman a
+    # init_db() no deben esperar detrás de un writer.
+    if version < 3:
+        cur.execute("CREATE TABLE IF NOT EXISTS exam_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);")
+        cur.execute("INSERT OR IGNORE INTO exam_meta (key, value) VALUES ('deletes', 0);")
+        cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_exam_results_delete AFTER DELETE ON exam_results
+        BEGIN
+            UPDATE exam_meta SET value = value + 1 WHERE key = 'deletes';
+        END;
+        """)
+        cur.execute("PRAGMA user_version = 3;")
+    # v4: ingest_key única (parcial: las filas sin clave no se deduplican), para
+    # que los reintentos de n8n no dupliquen resultados
+    if version < 4:
+        cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_exam_results_ingest_key
+        ON exam_results (ingest_key) WHERE ingest_key IS NOT NULL;
+        """)
+        cur.execute("PRAGMA user_version = 4;")
 
     conn.commit()
     conn.close()
@@ -67,36 +460,350 @@ def insert_result(
     answered_count: int = None,
     omitted_count: int = None,
     answers_json: str = None,
+    ingest_key: str = None,
     db_path: str = DB_PATH
 ):
+    """answers_json (lista o su JSON) se guarda en formato compacto, ver encode_answers()."""
+    insert_results([{
+        "student_id": student_id, "exam_id": exam_id, "correct": correct, "incorrect": incorrect,
+        "percent": percent, "timestamp": timestamp, "answered_count": answered_count,
+        "omitted_count": omitted_count, "answers_json": answers_json, "ingest_key": ingest_key,
+    }], db_path)
+
+# ---------- Normaliza el resultado devuelto por el corrector (n8n) ----------
+_RESULT_NUMBERS = ("correct_count", "incorrect_count", "answered_count", "omitted_count", "percent_correct")
+
+def normalize_result(result: dict, student_id: str = None, exam_id: str = None, timestamp: str = None) -> dict:
+    """
+    Valida el JSON de resultado del corrector y lo convierte en los argumentos
+    de insert_result(). Si faltan contadores se recalculan desde "answers".
+    answers_json sale ya codificado (encode_answers), así el costo de codificar
+    queda en quien llama y no en el hilo que escribe en la BD.
+    student_id/exam_id/timestamp son valores por defecto si el resultado no los trae.
+    ingest_key (idempotencia) es "idempotency_key" si viene, o exam_id|student_id|timestamp
+    si el resultado trae su propio timestamp; si no, None (sin deduplicar).
+    Lanza ValueError si la forma del resultado no es válida.
+    """
+    if not isinstance(result, dict):
+        raise ValueError("El resultado debe ser un objeto JSON.")
+    student_id = result.get("student_id", student_id)
+    exam_id = result.get("exam_id", exam_id)
+    for name, val in (("student_id", student_id), ("exam_id", exam_id)):
+        if not isinstance(val, str) or not val.strip():
+            raise ValueError(f"'{name}' es obligatorio y debe ser texto.")
+    numbers = {}
+    for name in _RESULT_NUMBERS:
+        val = result.get(name)
+        if val is None:
+            numbers[name] = None
+            continue
+        try:
+            if isinstance(val, bool):
+                raise TypeError
+            num = float(val)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{name}' debe ser numérico.")
+        if not math.isfinite(num):
+            raise ValueError(f"'{name}' debe ser un número finito.")
+        if name == "percent_correct":
+            numbers[name] = num
+        elif num.is_integer() and num >= 0:
+            numbers[name] = int(num)
+        else:
+            raise ValueError(f"'{name}' debe ser un entero no negativo.")
+    answers_detail = result.get("answers", [])
+    if answers_detail is None:
+        answers_detail = []
+    if not isinstance(answers_detail, list) or not all(isinstance(a, dict) for a in answers_detail):
+        raise ValueError("'answers' debe ser una lista de objetos.")
+    timestamp = result.get("timestamp", timestamp) or datetime.now().isoformat()
+    if _to_epoch(timestamp) is None:
+        raise ValueError("'timestamp' debe ser una fecha ISO.")
+    ingest_key = result.get("idempotency_key")
+    if ingest_key is not None and (not isinstance(ingest_key, str) or not ingest_key.strip()):
+        raise ValueError("'idempotency_key' debe ser texto no vacío.")
+    if ingest_key is None and result.get("timestamp"):
+        ingest_key = f"{exam_id.strip()}|{student_id.strip()}|{str(timestamp).strip()}"
+
+    correct = numbers["correct_count"]
+    incorrect = numbers["incorrect_count"]
+    answered_count = numbers["answered_count"]
+    omitted_count = numbers["omitted_count"]
+    percent = numbers["percent_correct"]
+
+    if answers_detail and (answered_count is None or omitted_count is None or correct is None or incorrect is None or percent is None):
+        det = []
+        for a in answers_detail:
+            q = a.get("q") or a.get("question")
+            sv = a.get("value") or a.get("studentValue")
+            cv = a.get("correctValue")
+            ic = a.get("isCorrect")
+            det.append({"q": q, "studentValue": sv, "correctValue": cv,
+                        "isCorrect": bool(ic) if ic is not None else (
+                            str(sv).upper()==str(cv).upper() if (sv and cv) else False)})
+        answered_count = sum(1 for d in det if d["studentValue"] is not None)
+        correct = sum(1 for d in det if d["isCorrect"])
+        incorrect = answered_count - correct
+        percent = round((correct/answered_count)*100, 2) if answered_count else 0.0
+        omitted_count = omitted_count if omitted_count is not None else 0
+        answers_detail = det
+
+    return {
+        "student_id": student_id.strip(),
+        "exam_id": exam_id.strip(),
+        "correct": int(correct or 0),
+        "incorrect": int(incorrect or 0),
+        "percent": float(percent or 0.0),
+        "timestamp": timestamp,
+        "answered_count": int(answered_count or 0),
+        "omitted_count": int(omitted_count or 0),
+        "answers_json": encode_answers(answers_detail or []),
+        "ingest_key": ingest_key.strip() if ingest_key else None,
+    }
+
+# ---------- Inserta varios resultados en una sola transacción ----------
+def insert_results(rows: list, db_path: str = DB_PATH, conn=None) -> int:
+    """
+    Inserta muchos resultados (dicts con los argumentos de insert_result) con un
+    único commit. Con conn se reutiliza una conexión abierta (ya inicializada).
+    Las filas cuya ingest_key ya existe se omiten (reintentos). Devuelve cuántas
+    filas se insertaron.
+    """
+    params = [(
+        r["student_id"], r["exam_id"], int(r.get("correct") or 0), int(r.get("incorrect") or 0),
+        float(r.get("percent") or 0.0), r["timestamp"], _to_epoch(r["timestamp"]),
+        int(r.get("answered_count") or 0), int(r.get("omitted_count") or 0),
+        encode_answers(r.get("answers_json")), r.get("ingest_key")
+    ) for r in rows]
+    own = conn is None
+    if own:
+        init_db(db_path)
+        conn = sqlite3.connect(db_path)
+    try:
+        before = conn.total_changes
+        with conn:
+            conn.executemany("""
+                INSERT INTO exam_results
+                (student_id, exam_id, correct_count, incorrect_count, percent_correct, timestamp,
+                 ts_epoch, answered_count, omitted_count, answers_json, ingest_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ingest_key) WHERE ingest_key IS NOT NULL DO NOTHING;
+            """, params)
+        inserted = conn.total_changes - before
+    finally:
+        if own:
+            conn.close()
+    return inserted
+
+# ---------- Lee datos (para dashboard) ----------
+def load_data(
+    db_path: str = DB_PATH,
+    exam_ids: list = None,
+    start_epoch: int = None,
+    end_epoch: int = None,
+    with_answers: bool = False,
+    arrow_strings: bool = False,
+    min_id: int = None
+) -> pd.DataFrame:
+    """
+    Lee resultados ordenados por ts_epoch (más recientes primero).
+    Filtros opcionales (se resuelven con los índices sobre exam_id/ts_epoch):
+      - exam_ids: lista de exam_id a incluir.
+      - start_epoch / end_epoch: rango [start, end) en segundos epoch.
+      - min_id: solo filas con id > min_id (carga incremental, ver append_results).
+    answers_json solo se lee con with_answers=True (vistas de detalle/exportación);
+    para el resto usa load_answers() sobre los ids que realmente se muestran.
+    Los tipos se compactan con _compact_dtypes().
+    """
     init_db(db_path)
+    where, params = [], []
+    if exam_ids is not None:
+        exam_ids = list(exam_ids)
+        if not exam_ids:
+            where.append("0")
+        else:
+            where.append(f"exam_id IN ({', '.join('?' * len(exam_ids))})")
+            params.extend(exam_ids)
+    if start_epoch is not None:
+        where.append("ts_epoch >= ?")
+        params.append(int(start_epoch))
+    if end_epoch is not None:
+        where.append("ts_epoch < ?")
+        params.append(int(end_epoch))
+    if min_id is not None:
+        where.append("id > ?")
+        params.append(int(min_id))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    cols = list(RESULT_COLUMNS)
+    if with_answers:
+        cols.insert(cols.index("timestamp"), "answers_json")
+
     conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO exam_results
-        (student_id, exam_id, correct_count, incorrect_count, percent_correct, timestamp,
-         answered_count, omitted_count, answers_json)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
-    """, (
-        student_id, exam_id, int(correct), int(incorrect), float(percent), timestamp,
-        int(answered_count or 0), int(omitted_count or 0), answers_json
-    ))
-    conn.commit()
+    df = pd.read_sql_query(f"""
+        SELECT {', '.join(cols)}
+        FROM exam_results
+        {where_sql}
+        ORDER BY ts_epoch DESC, id DESC;
+    """, conn, params=params)
     conn.close()
+    if with_answers:
+        df["answers_json"] = df["answers_json"].map(_answers_to_json_safe)
+    return _compact_dtypes(df, arrow_strings=arrow_strings)
 
-# ---------- Lee datos (para dashboard) ----------
-def load_data(db_path: str = DB_PATH) -> pd.DataFrame:
+def results_version(db_path: str = DB_PATH) -> tuple:
+    """
+    Token de cambios barato: (MAX(id), borrados). MAX(id) se resuelve con la
+    rowid y crece con cada inserción; el contador de borrados lo mantiene un
+    trigger, así que también cambia con retención o borrados manuales.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        max_id = conn.execute("SELECT MAX(id) FROM exam_results;").fetchone()[0]
+        deletes = conn.execute("SELECT value FROM exam_meta WHERE key = 'deletes';").fetchone()
+    except sqlite3.OperationalError:
+        return (0, 0)
+    finally:
+        conn.close()
+    return (int(max_id or 0), int(deletes[0]) if deletes else 0)
+
+def append_results(df: pd.DataFrame, new_rows: pd.DataFrame) -> pd.DataFrame:
+    """Agrega filas nuevas (de load_data(min_id=...)) a un DataFrame ya cargado."""
+    if new_rows.empty:
+        return df
+    if df.empty:
+        return new_rows
+    out = pd.concat([new_rows, df], ignore_index=True)
+    out = out.drop_duplicates("id").sort_values(["ts_epoch", "id"], ascending=False, ignore_index=True)
+    # concat de categorías distintas vuelve a object
+    for col in ("exam_id", "student_id"):
+        if col in out.columns and out[col].dtype != "category":
+            out[col] = out[col].astype("category")
+    return out
+
+def load_answers(ids, db_path: str = DB_PATH) -> dict:
+    """Devuelve {id: lista de respuestas decodificada} solo para los ids indicados."""
+    ids = [int(i) for i in ids]
+    out = {}
+    if not ids:
+        return out
     init_db(db_path)
     conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query("""
-        SELECT id, student_id, exam_id, correct_count, incorrect_count, percent_correct,
-               answered_count, omitted_count, answers_json, timestamp
-        FROM exam_results
-        ORDER BY timestamp DESC;
-    """, conn)
+    cur = conn.cursor()
+    # Lotes para no superar el límite de parámetros de SQLite
+    for i in range(0, len(ids), 900):
+        chunk = ids[i:i + 900]
+        cur.execute(
+            f"SELECT id, answers_json FROM exam_results WHERE id IN ({', '.join('?' * len(chunk))});",
+            chunk
+        )
+        for rid, aj in cur.fetchall():
+            try:
+                out[rid] = decode_answers(aj)
+            except (ValueError, zlib.error):
+                out[rid] = []
     conn.close()
+    return out
+
+def attach_answers(df: pd.DataFrame, db_path: str = DB_PATH) -> pd.DataFrame:
+    """Agrega answers_json (JSON original, como en las exportaciones) a un DataFrame cargado sin ella."""
+    if "answers_json" in df.columns or df.empty:
+        return df
+    answers = load_answers(df["id"].tolist(), db_path)
+    df = df.copy()
+    df["answers_json"] = df["id"].map(lambda i: json.dumps(answers.get(i) or [], ensure_ascii=False))
+    return df
+
+def explode_answers(df: pd.DataFrame) -> pd.DataFrame:
+    cols = {k: [] for k in ("timestamp", "exam_id", "student_id",
+                            "q", "studentValue", "correctValue", "isCorrect")}
+    for ts, ex, sid, aj in zip(df["timestamp"], df["exam_id"], df["student_id"], df["answers_json"]):
+        try:
+            det = decode_answers_columns(aj)
+        except Exception:
+            continue
+        n = len(det["q"])
+        cols["timestamp"].extend([ts] * n)
+        cols["exam_id"].extend([ex] * n)
+        cols["student_id"].extend([sid] * n)
+        for k in ("q", "studentValue", "correctValue", "isCorrect"):
+            cols[k].extend(det[k])
+    return pd.DataFrame(cols)
+
+# ---------- Tipos compactos ----------
+def _arrow_string_dtype():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    return "string[pyarrow]"
+
+def _compact_dtypes(df: pd.DataFrame, arrow_strings: bool = False) -> pd.DataFrame:
+    """
+    Reduce memoria: exam_id/student_id como category, enteros reducidos al tipo
+    más chico posible y (opcional) textos como string[pyarrow].
+    """
+    for col in ("exam_id", "student_id"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in INT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col].fillna(0), downcast="integer")
+    # percent_correct se deja en float64: float32 se vería en los exportes (66.66999816...)
+    if "percent_correct" in df.columns:
+        df["percent_correct"] = pd.to_numeric(df["percent_correct"].fillna(0.0)).astype("float64")
+    if arrow_strings:
+        dtype = _arrow_string_dtype()
+        if dtype:
+            for col in ("timestamp", "answers_json"):
+                if col in df.columns:
+                    df[col] = df[col].astype(dtype)
     return df
 
+def memory_report(db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    Memoria (MB por 100k filas) de la carga original (todas las columnas, tipos
+    object, answers_json como JSON de texto) frente a la carga compacta, con y
+    sin strings Arrow.
+    """
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    legacy = pd.read_sql_query("SELECT * FROM exam_results;", conn)
+    conn.close()
+    # Tras la migración answers_json está empaquetado/comprimido: se expande al
+    # JSON original para que la línea base sea la carga previa a la migración.
+    legacy["answers_json"] = legacy["answers_json"].map(_answers_to_json_safe)
+
+    variants = {
+        "original": legacy,
+        "compacto": load_data(db_path),
+        "compacto + answers_json": load_data(db_path, with_answers=True),
+    }
+    if _arrow_string_dtype():
+        variants["compacto + answers_json (arrow)"] = load_data(db_path, with_answers=True, arrow_strings=True)
+
+    rows = []
+    for name, frame in variants.items():
+        n = len(frame)
+        total = int(frame.memory_usage(deep=True).sum())
+        rows.append({
+            "carga": name,
+            "filas": n,
+            "MB": round(total / 1e6, 2),
+            "MB por 100k filas": round(total / n * 100_000 / 1e6, 2) if n else 0.0,
+        })
+    return pd.DataFrame(rows)
+
+def date_to_epoch(d, end: bool = False) -> int:
+    """
+    Epoch (hora local) de la medianoche de la fecha d.
+    Con end=True devuelve la medianoche del día siguiente (límite exclusivo).
+    """
+    dt = datetime.combine(d, time.min)
+    if end:
+        dt += timedelta(days=1)
+    return int(dt.timestamp())
+
 # ---------- Siguiente secuencia para student_id dentro de un exam_id ----------
 def next_student_seq_for_exam(exam_id: str, db_path: str = DB_PATH) -> int:
     """
@@ -140,13 +847,15 @@ def graficar(df: pd.DataFrame) -> BytesIO:
 
     buffer = BytesIO()
     fig.savefig(buffer, format="png", dpi=150)
+    plt.close(fig)
     buffer.seek(0)
     return buffer
 
 def _pdf_safe(text: str) -> str:
     return ''.join(ch for ch in text if ord(ch) <= 0xFFFF and ch != '\uFE0F')
 
-def generar_pdf(df: pd.DataFrame, stats: dict, fig_buffer: BytesIO, pdf_path: str = PDF_FILE):
+def generar_pdf(df: pd.DataFrame, stats: dict, fig_buffer: BytesIO, pdf_path: str = PDF_FILE,
+                verbose: bool = True):
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", "B", 16)
@@ -170,11 +879,546 @@ def generar_pdf(df: pd.DataFrame, stats: dict, fig_buffer: BytesIO, pdf_path: st
         pdf.cell(0, 8, _pdf_safe(line), ln=True)
 
     pdf.output(pdf_path)
-    print(f"✅ Reporte PDF generado: {pdf_path}")
+    if verbose:
+        print(f"✅ Reporte PDF generado: {pdf_path}")
+
+# ---------- Reportes por examen/estudiante (CLI, en paralelo) ----------
+REPORTS_DIR = str(BASE_DIR / "reportes")
+_MANIFEST_NAME = ".manifest.json"
+
+def _safe_name(name) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(name)).strip("_") or "sin_nombre"
+
+def exam_signatures(db_path: str = DB_PATH) -> dict:
+    """
+    Firma por exam_id (filas, id máximo, ts_epoch máximo). Si no cambia, los
+    reportes de ese examen no necesitan regenerarse.
+    """
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("""
+        SELECT exam_id, COUNT(*), MAX(id), MAX(ts_epoch)
+        FROM exam_results
+        GROUP BY exam_id;
+    """).fetchall()
+    conn.close()
+    return {ex: f"{n}:{max_id}:{max_ts}" for ex, n, max_id, max_ts in rows}
+
+def _write_report_set(df: pd.DataFrame, base_path: Path, titulo: str) -> int:
+    """Escribe <base>.pdf, <base>.csv y <base>.xlsx. Devuelve cuántos archivos escribió."""
+    stats = generar_estadisticas(df)
+    generar_pdf(df, stats, graficar(df), str(base_path.with_suffix(".pdf")), verbose=False)
+    df.to_csv(base_path.with_suffix(".csv"), index=False)
+    with pd.ExcelWriter(base_path.with_suffix(".xlsx"), engine="xlsxwriter") as writer:
+        pd.DataFrame([{"Reporte": titulo, **stats}]).to_excel(writer, sheet_name="Resumen", index=False)
+        df.to_excel(writer, sheet_name="Resultados", index=False)
+        explode_answers(df).to_excel(writer, sheet_name="DetallePreguntas", index=False)
+    return 3
+
+def _exam_report_job(db_path: str, exam_id: str, out_dir: str, per_student: bool) -> tuple:
+    """
+    Genera los reportes de un examen en un proceso del pool.
+    matplotlib no es thread-safe, por eso se usan procesos con backend Agg.
+    """
+    plt.switch_backend("Agg")
+    t0 = perf_counter()
+    df = attach_answers(load_data(db_path, exam_ids=[exam_id]), db_path)
+    if df.empty:
+        return exam_id, 0, perf_counter() - t0
+
+    exam_dir = Path(out_dir) / _safe_name(exam_id)
+    exam_dir.mkdir(parents=True, exist_ok=True)
+    written = _write_report_set(df, exam_dir / "reporte", f"Examen {exam_id}")
+
+    if per_student:
+        students_dir = exam_dir / "estudiantes"
+        students_dir.mkdir(exist_ok=True)
+        for sid, sdf in df.groupby("student_id", observed=True):
+            written += _write_report_set(sdf, students_dir / _safe_name(sid),
+                                         f"Examen {exam_id} · {sid}")
+    return exam_id, written, perf_counter() - t0
+
+def _read_manifest(out_dir: Path) -> dict:
+    try:
+        return json.loads((out_dir / _MANIFEST_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def generar_reportes(
+    db_path: str = DB_PATH,
+    out_dir: str = REPORTS_DIR,
+    jobs: int = None,
+    per_student: bool = False,
+    force: bool = False
+) -> dict:
+    """
+    Genera PDF/CSV/XLSX por examen (y opcionalmente por estudiante) con un pool
+    de procesos. Los exámenes cuya firma no cambió desde la última corrida se
+    omiten salvo force=True. Devuelve un resumen de rendimiento.
+    """
+    t0 = perf_counter()
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    signatures = exam_signatures(db_path)
+    manifest = {} if force else _read_manifest(out)
+    pending = [ex for ex, sig in sorted(signatures.items())
+               if manifest.get(ex, {}).get("firma") != sig
+               or manifest.get(ex, {}).get("por_estudiante") != per_student]
+
+    files, errors = 0, []
+    jobs = max(1, int(jobs or os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_exam_report_job, db_path, ex, str(out), per_student): ex for ex in pending}
+        for fut in as_completed(futures):
+            ex = futures[fut]
+            try:
+                _, written, _ = fut.result()
+            except Exception as e:
+                errors.append(f"{ex}: {e}")
+                continue
+            files += written
+            manifest[ex] = {"firma": signatures[ex], "por_estudiante": per_student}
+            # Se guarda tras cada examen para que una corrida cortada no repita trabajo
+            (out / _MANIFEST_NAME).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    elapsed = perf_counter() - t0
+    return {
+        "Exámenes": len(signatures),
+        "Generados": len(pending) - len(errors),
+        "Omitidos (sin cambios)": len(signatures) - len(pending),
+        "Errores": errors,
+        "Archivos escritos": files,
+        "Procesos": jobs,
+        "Tiempo (s)": round(elapsed, 2),
+        "Archivos/s": round(files / elapsed, 2) if elapsed else 0.0,
+    }
+
+# ---------- Importación masiva desde CSV/XLSX (formato de make_exports) ----------
+_IMPORT_REQUIRED = ("student_id", "exam_id", "timestamp")
+_IMPORT_INT_COLUMNS = ("correct_count", "incorrect_count", "answered_count", "omitted_count")
+_SECONDARY_INDEXES = ("idx_exam_results_exam_ts", "idx_exam_results_ts")
+
+def _iter_csv_chunks(path: str, chunksize: int):
+    yield from pd.read_csv(path, dtype=str, chunksize=chunksize, encoding="utf-8-sig")
+
+def _iter_xlsx_chunks(path: str, chunksize: int, sheet: str = "Resultados"):
+    """Lee la hoja en modo streaming (openpyxl read_only), sin cargar el libro completo."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError("Para importar .xlsx instala openpyxl (pip install openpyxl).")
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet in wb.sheetnames else wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, [])]
+        buf = []
+        for r in rows:
+            buf.append(r)
+            if len(buf) >= chunksize:
+                yield pd.DataFrame(buf, columns=header, dtype=object)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=header, dtype=object)
+    finally:
+        wb.close()
+
+def _iter_import_chunks(path: str, chunksize: int):
+    if Path(path).suffix.lower() in (".xlsx", ".xlsm"):
+        return _iter_xlsx_chunks(path, chunksize)
+    return _iter_csv_chunks(path, chunksize)
+
+def _import_timestamp(value) -> tuple:
+    """
+    (texto ISO, epoch en ms) de un timestamp del archivo. El texto se conserva tal cual
+    si ya es ISO (con su desfase UTC, si lo trae); si no, se intenta con pandas.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None, None
+    if isinstance(value, datetime):
+        text = value.isoformat()
+    else:
+        text = str(value).strip()
+    epoch_ms = _to_epoch_ms(text)
+    if epoch_ms is None and text:
+        try:
+            text = pd.Timestamp(text).isoformat()
+        except (ValueError, TypeError):
+            return None, None
+        epoch_ms = _to_epoch_ms(text)
+    return (text, epoch_ms) if epoch_ms is not None else (None, None)
+
+def _prepare_import_chunk(chunk: pd.DataFrame) -> tuple:
+    """
+    Valida y normaliza un bloque del archivo. Devuelve (filas, claves, inválidas)
+    donde filas son tuplas listas para el INSERT (mismo orden que insert_results)
+    y claves, la clave de deduplicación (exam_id, student_id, epoch en ms) de cada fila.
+    Se ejecuta en procesos del pool: no toca la BD.
+    """
+    chunk.columns = [str(c).strip() for c in chunk.columns]
+    missing = [c for c in _IMPORT_REQUIRED if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(missing)}")
+    total = len(chunk)
+
+    for col in ("student_id", "exam_id"):
+        chunk[col] = chunk[col].astype("string").str.strip()
+    parsed = [_import_timestamp(v) for v in chunk["timestamp"]]
+    chunk["timestamp"] = [t for t, _ in parsed]
+    chunk["ts_epoch_ms"] = [e for _, e in parsed]
+    valid = ((chunk["student_id"].fillna("") != "") & (chunk["exam_id"].fillna("") != "")
+             & chunk["ts_epoch_ms"].notna())
+    chunk = chunk[valid].copy()
+    epoch_ms = chunk["ts_epoch_ms"].astype("int64")
+
+    for col in _IMPORT_INT_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce").fillna(0).astype("int64")
+        else:
+            chunk[col] = 0
+    if "percent_correct" in chunk.columns:
+        chunk["percent_correct"] = pd.to_numeric(chunk["percent_correct"], errors="coerce").fillna(0.0)
+    else:
+        chunk["percent_correct"] = 0.0
+    if "answers_json" in chunk.columns:
+        answers = [encode_answers(a) if isinstance(a, str) and a.strip() else None
+                   for a in chunk["answers_json"]]
+    else:
+        answers = [None] * len(chunk)
+
+    rows = list(zip(
+        chunk["student_id"].tolist(), chunk["exam_id"].tolist(),
+        chunk["correct_count"].tolist(), chunk["incorrect_count"].tolist(),
+        chunk["percent_correct"].astype(float).tolist(), chunk["timestamp"].tolist(),
+        (epoch_ms // 1000).tolist(),
+        chunk["answered_count"].tolist(), chunk["omitted_count"].tolist(),
+        answers,
+    ))
+    keys = list(zip(chunk["exam_id"].tolist(), chunk["student_id"].tolist(), epoch_ms.tolist()))
+    return rows, keys, total - len(rows)
+
+def importar_resultados(
+    paths: list,
+    db_path: str = DB_PATH,
+    chunksize: int = 50_000,
+    jobs: int = None
+) -> dict:
+    """
+    Importa CSV/XLSX históricos (columnas de la hoja "Resultados" de make_exports)
+    por bloques. Deduplica por (exam_id, student_id, epoch en ms) contra la BD y
+    dentro de los propios archivos, inserta en una transacción por bloque y
+    reconstruye los índices secundarios al final.
+    """
+    t0 = perf_counter()
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA cache_size=-200000;")
+
+    # Claves existentes. Epoch en ms y no el texto: el mismo instante puede estar
+    # escrito de varias formas; ms y no segundos: no colapsar resultados distintos
+    # dentro del mismo segundo. Se guardan las tuplas (no su hash) para que una
+    # colisión no descarte una fila.
+    seen = set()
+    for exam_id, student_id, ts, ts_epoch in conn.execute(
+            "SELECT exam_id, student_id, timestamp, ts_epoch FROM exam_results;"):
+        ms = _to_epoch_ms(ts)
+        if ms is None:
+            ms = ts_epoch * 1000 if ts_epoch is not None else None
+        seen.add((exam_id, student_id, ms))
+
+    for name in _SECONDARY_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name};")
+
+    stats = {"Leídas": 0, "Insertadas": 0, "Duplicadas": 0, "Inválidas": 0}
+    jobs = max(1, int(jobs or os.cpu_count() or 1))
+
+    def _insert(rows, keys, invalid):
+        fresh = []
+        for r, key in zip(rows, keys):
+            if key in seen:
+                continue
+            seen.add(key)
+            fresh.append(r)
+        with conn:
+            conn.executemany("""
+                INSERT INTO exam_results
+                (student_id, exam_id, correct_count, incorrect_count, percent_correct, timestamp,
+                 ts_epoch, answered_count, omitted_count, answers_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """, fresh)
+        stats["Leídas"] += len(rows) + invalid
+        stats["Inválidas"] += invalid
+        stats["Insertadas"] += len(fresh)
+        stats["Duplicadas"] += len(rows) - len(fresh)
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for path in paths:
+                # Como mucho 2 bloques por proceso en vuelo, para acotar memoria;
+                # se insertan en orden para que gane la primera aparición de cada clave.
+                in_flight = deque()
+                for chunk in _iter_import_chunks(path, chunksize):
+                    in_flight.append(pool.submit(_prepare_import_chunk, chunk))
+                    if len(in_flight) >= jobs * 2:
+                        _insert(*in_flight.popleft().result())
+                while in_flight:
+                    _insert(*in_flight.popleft().result())
+    finally:
+        conn.close()
+        init_db(db_path)  # recrea los índices secundarios
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("ANALYZE exam_results;")
+    conn.close()
+
+    elapsed = perf_counter() - t0
+    stats["Tiempo (s)"] = round(elapsed, 2)
+    stats["Filas/s"] = round(stats["Leídas"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+# ---------- Retención, archivo y compactación ----------
+_RESULT_COLS_SQL = ("id, student_id, exam_id, correct_count, incorrect_count, percent_correct, "
+                    "timestamp, ts_epoch, answered_count, omitted_count, answers_json")
+
+def load_aggregates(db_path: str = DB_PATH) -> pd.DataFrame:
+    """Agregados históricos (por examen y mes) de los resultados archivados."""
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    df = pd.read_sql_query("""
+        SELECT exam_id, period, n_results,
+               ROUND(sum_percent / n_results, 2) AS avg_percent,
+               min_percent, max_percent, sum_correct, sum_incorrect
+        FROM exam_aggregates
+        WHERE n_results > 0
+        ORDER BY exam_id, period;
+    """, conn)
+    conn.close()
+    return df
+
+def _db_size(path: str) -> int:
+    # Incluye el -wal si la BD está en modo WAL
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+def _compactar_bd(conn, max_pages: int = None):
+    """
+    Devuelve páginas libres al sistema. La primera vez cambia la BD a
+    auto_vacuum=INCREMENTAL (requiere un VACUUM completo); desde entonces basta
+    con PRAGMA incremental_vacuum, que es mucho más barato.
+    """
+    if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        conn.execute("VACUUM;")
+    elif max_pages:
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    else:
+        conn.execute("PRAGMA incremental_vacuum;")
+    conn.execute("ANALYZE;")
+    conn.execute("PRAGMA optimize;")
+
+def aplicar_retencion(
+    max_age_days: int,
+    db_path: str = DB_PATH,
+    archive_path: str = ARCHIVE_DB_PATH,
+    parquet_dir: str = None,
+    batch_size: int = 5000,
+    vacuum_pages: int = None
+) -> dict:
+    """
+    Mueve los resultados con más de max_age_days días a un archivo (otra BD
+    SQLite con answers_json ya comprimido o, con parquet_dir, un Parquet zstd),
+    acumula sus agregados por examen/mes en exam_aggregates y compacta la BD.
+    Trabaja por lotes de batch_size filas, cada uno en su propia transacción.
+    """
+    t0 = perf_counter()
+    cutoff = int((datetime.now() - timedelta(days=max_age_days)).timestamp())
+    init_db(db_path)
+    size_before = _db_size(db_path)
+
+    parquet_writer = None
+    if parquet_dir:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Para archivar en Parquet instala pyarrow (pip install pyarrow).")
+        Path(parquet_dir).mkdir(parents=True, exist_ok=True)
+        parquet_path = Path(parquet_dir) / f"exam_results_{datetime.now():%Y%m%d_%H%M%S}.parquet"
+    else:
+        init_db(archive_path)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000;")
+    if not parquet_dir:
+        conn.execute("ATTACH DATABASE ? AS arch;", (archive_path,))
+
+    moved = 0
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                conn.execute("DROP TABLE IF EXISTS temp._batch;")
+                conn.execute("""
+                    CREATE TEMP TABLE _batch AS
+                    SELECT id FROM exam_results
+                    WHERE ts_epoch < ?
+                    ORDER BY ts_epoch
+                    LIMIT ?;
+                """, (cutoff, batch_size))
+                n = conn.execute("SELECT COUNT(*) FROM temp._batch;").fetchone()[0]
+                if not n:
+                    conn.execute("COMMIT;")
+                    break
+
+                if parquet_dir:
+                    batch = pd.read_sql_query(
+                        f"SELECT {_RESULT_COLS_SQL} FROM exam_results WHERE id IN (SELECT id FROM temp._batch);",
+                        conn)
+                    batch["answers_json"] = batch["answers_json"].map(_answers_to_json_safe)
+                    table = pa.Table.from_pandas(batch, preserve_index=False)
+                    if parquet_writer is None:
+                        parquet_writer = pq.ParquetWriter(str(parquet_path), table.schema, compression="zstd")
+                    parquet_writer.write_table(table)
+                else:
+                    # INSERT simple: si el archivo ya tiene ese id (p. ej. results.db se
+                    # recreó), falla y se revierte el lote en vez de borrar sin archivar.
+                    copied = conn.execute(f"""
+                        INSERT INTO arch.exam_results ({_RESULT_COLS_SQL})
+                        SELECT {_RESULT_COLS_SQL} FROM exam_results
+                        WHERE id IN (SELECT id FROM temp._batch);
+                    """).rowcount
+                    if copied != n:
+                        raise sqlite3.IntegrityError(
+                            f"Solo se archivaron {copied} de {n} filas; no se borra nada.")
+
+                conn.execute("""
+                    INSERT INTO exam_aggregates
+                        (exam_id, period, n_results, sum_percent, min_percent, max_percent,
+                         sum_correct, sum_incorrect, first_epoch, last_epoch)
+                    SELECT exam_id, strftime('%Y-%m', ts_epoch, 'unixepoch', 'localtime'),
+                           COUNT(*), SUM(percent_correct), MIN(percent_correct), MAX(percent_correct),
+                           SUM(correct_count), SUM(incorrect_count), MIN(ts_epoch), MAX(ts_epoch)
+                    FROM exam_results
+                    WHERE id IN (SELECT id FROM temp._batch)
+                    GROUP BY 1, 2
+                    ON CONFLICT (exam_id, period) DO UPDATE SET
+                        n_results = n_results + excluded.n_results,
+                        sum_percent = sum_percent + excluded.sum_percent,
+                        min_percent = MIN(min_percent, excluded.min_percent),
+                        max_percent = MAX(max_percent, excluded.max_percent),
+                        sum_correct = sum_correct + excluded.sum_correct,
+                        sum_incorrect = sum_incorrect + excluded.sum_incorrect,
+                        first_epoch = MIN(first_epoch, excluded.first_epoch),
+                        last_epoch = MAX(last_epoch, excluded.last_epoch);
+                """)
+                conn.execute("DELETE FROM exam_results WHERE id IN (SELECT id FROM temp._batch);")
+                conn.execute("COMMIT;")
+            except Exception:
+                conn.execute("ROLLBACK;")
+                raise
+            moved += n
+        conn.execute("DROP TABLE IF EXISTS temp._batch;")
+        if not parquet_dir:
+            conn.execute("DETACH DATABASE arch;")
+        if moved:
+            _compactar_bd(conn, vacuum_pages)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+        conn.close()
+
+    if moved and not parquet_dir:
+        arch = sqlite3.connect(archive_path)
+        arch.execute("ANALYZE;")
+        arch.close()
+
+    return {
+        "Movidas al archivo": moved,
+        "Archivo": str(parquet_path) if parquet_dir else archive_path,
+        "Corte": datetime.fromtimestamp(cutoff).isoformat(timespec="seconds"),
+        "BD antes (MB)": round(size_before / 1e6, 2),
+        "BD después (MB)": round(_db_size(db_path) / 1e6, 2),
+        "Tiempo (s)": round(perf_counter() - t0, 2),
+    }
 
 # CLI opcional
 def main():
-    df = load_data()
+    import argparse
+    parser = argparse.ArgumentParser(description="Reportes de resultados de exámenes (SQLite).")
+    parser.add_argument("--db", default=DB_PATH, help="Ruta a la base de datos")
+    parser.add_argument("--memoria", action="store_true",
+                        help="Muestra memoria por 100k filas (carga original vs compacta)")
+    parser.add_argument("--sin-epoch", action="store_true",
+                        help="Lista las filas cuyo timestamp no se pudo convertir a ts_epoch")
+    parser.add_argument("--compactar-respuestas", action="store_true",
+                        help="Convierte answers_json al formato compacto y compara tamaño/decodificación")
+    parser.add_argument("--reportes", action="store_true",
+                        help="Genera PDF/CSV/XLSX por examen en paralelo (omite exámenes sin cambios)")
+    parser.add_argument("--por-estudiante", action="store_true",
+                        help="Con --reportes, genera además un reporte por estudiante")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Procesos para --reportes/--importar (por defecto, número de CPUs)")
+    parser.add_argument("--salida", default=REPORTS_DIR, help="Carpeta de salida para --reportes")
+    parser.add_argument("--forzar", action="store_true",
+                        help="Con --reportes, regenera aunque el examen no haya cambiado")
+    parser.add_argument("--importar", nargs="+", metavar="ARCHIVO",
+                        help="Importa resultados históricos desde CSV/XLSX (formato de exportación)")
+    parser.add_argument("--bloque", type=int, default=50_000,
+                        help="Filas por bloque/transacción para --importar")
+    parser.add_argument("--retencion", type=int, metavar="DIAS",
+                        help="Archiva resultados con más de DIAS días, guarda agregados y compacta la BD")
+    parser.add_argument("--archivo", default=ARCHIVE_DB_PATH,
+                        help="BD SQLite de archivo para --retencion")
+    parser.add_argument("--parquet", metavar="CARPETA",
+                        help="Con --retencion, archiva en Parquet (zstd) en CARPETA en vez de SQLite")
+    args = parser.parse_args()
+
+    if args.retencion is not None:
+        summary = aplicar_retencion(args.retencion, args.db, args.archivo, parquet_dir=args.parquet)
+        print("🗄️ Retención:")
+        for k, v in summary.items():
+            print(f"  {k}: {v}")
+        return
+
+    if args.importar:
+        summary = importar_resultados(args.importar, args.db, chunksize=args.bloque, jobs=args.jobs)
+        print("📥 Importación:")
+        for k, v in summary.items():
+            print(f"  {k}: {v}")
+        return
+
+    if args.reportes:
+        summary = generar_reportes(args.db, args.salida, jobs=args.jobs,
+                                   per_student=args.por_estudiante, force=args.forzar)
+        print("📦 Reportes:")
+        for k, v in summary.items():
+            if k == "Errores":
+                for err in v:
+                    print(f"  ❌ {err}")
+                continue
+            print(f"  {k}: {v}")
+        return
+
+    if args.memoria:
+        print(memory_report(args.db).to_string(index=False))
+        return
+
+    if args.sin_epoch:
+        init_db(args.db)
+        rows = missing_epoch_rows(args.db)
+        print(f"🕒 Filas sin ts_epoch: {len(rows)}")
+        for rid, ts in rows:
+            print(f"  id={rid} timestamp={ts!r}")
+        return
+
+    if args.compactar_respuestas:
+        init_db(args.db)
+        print(f"🗜️ Filas convertidas: {compact_answers(args.db)}")
+        for k, v in answers_storage_report(args.db).items():
+            print(f"  {k}: {v}")
+        return
+
+    df = load_data(args.db)
     if df.empty:
         print("⚠️ No se encontraron registros.")
         return
@@ -5,18 +5,27 @@ import matplotlib.pyplot as plt
 from io import BytesIO
 from fpdf import FPDF
 from datetime import datetime
-import requests, json, csv, io, re
+import requests, json, csv, io, os, re
 from pathlib import Path
 
 from analyze_results_sqlite import (
-    load_data, init_db, insert_result, DB_PATH, next_student_seq_for_exam
+    load_data, load_answers, attach_answers, explode_answers, init_db, insert_result,
+    normalize_result, results_version, append_results, load_aggregates, DB_PATH,
+    next_student_seq_for_exam, date_to_epoch
 )
 
+from upload_preprocess import preprocess_exam_file, UPLOAD_SETTINGS
+
 # Estilos
 from styles import apply_css, TOKENS
 
 USERS = {"admin": "admin123", "profesor": "clave2025"}
 N8N_WEBHOOK_URL = "https://mari25.app.n8n.cloud/webhook-test/exam-auto-grader"
+# Cada cuántos segundos el Resumen revisa si llegaron resultados nuevos
+REFRESH_SECONDS = 5
+# Ingesta directa: el flujo de n8n guarda el resultado vía POST /results
+# (ingest_server.py). En ese caso el panel no lo inserta otra vez.
+DIRECT_INGEST = os.environ.get("DIRECT_INGEST", "").strip().lower() in ("1", "true", "si", "sí")
 
 st.set_page_config(page_title="AutoGrader | Panel", page_icon="📘", layout="wide")
 apply_css(TOKENS)
@@ -104,27 +113,6 @@ def slugify_exam_name(name: str) -> str:
     s = re.sub(r'_+', '_', s).strip('_')
     return s or "examen"
 
-def explode_answers(df: pd.DataFrame) -> pd.DataFrame:
-    rows = []
-    for _, r in df.iterrows():
-        try:
-            aj = r.get("answers_json")
-            if pd.notna(aj) and str(aj).strip() != "":
-                arr = json.loads(aj)
-                for a in arr or []:
-                    rows.append({
-                        "timestamp": r["timestamp"],
-                        "exam_id": r["exam_id"],
-                        "student_id": r["student_id"],
-                        "q": a.get("q") or a.get("question"),
-                        "studentValue": a.get("value") or a.get("studentValue"),
-                        "correctValue": a.get("correctValue"),
-                        "isCorrect": a.get("isCorrect")
-                    })
-        except Exception:
-            continue
-    return pd.DataFrame(rows)
-
 # ---------- Login (sin inputs vacíos) ----------
 def autenticar_usuario():
     if "logged_in" not in st.session_state:
@@ -202,6 +190,12 @@ def _form_contenido():
         preview_exam = slugify_exam_name(Path(exam_file.name).stem)
         st.caption(f"Detectado exam_id: `{preview_exam}` (student_id se enumerará: est01, est02, …)")
 
+    optimize_upload = st.checkbox(
+        "Optimizar imagen antes de enviar (gris, "
+        f"{UPLOAD_SETTINGS['target_dpi']} DPI, máx. {UPLOAD_SETTINGS['max_bytes']/1e6:.1f} MB)",
+        value=UPLOAD_SETTINGS["enabled"]
+    )
+
     if st.button("Enviar para corrección", type="primary", use_container_width=True):
         if not exam_file:
             st.warning("Debes subir un archivo (PDF o imagen)."); st.stop()
@@ -218,9 +212,18 @@ def _form_contenido():
 
         file_bytes = exam_file.getvalue()
         mime = (exam_file.type or "").lower()
+        file_name = exam_file.name
+        if optimize_upload:
+            try:
+                raw_size = len(file_bytes)
+                file_bytes, mime, file_name = preprocess_exam_file(file_bytes, mime, file_name)
+                if len(file_bytes) < raw_size:
+                    st.caption(f"Imagen optimizada: {raw_size/1e6:.1f} MB → {len(file_bytes)/1e6:.1f} MB")
+            except Exception:
+                file_bytes, mime, file_name = exam_file.getvalue(), (exam_file.type or "").lower(), exam_file.name
         files = {
             'exam_file': (
-                exam_file.name,
+                file_name,
                 file_bytes,
                 mime if mime in ["application/pdf", "image/jpeg", "image/png"] else "application/octet-stream"
             )
@@ -243,44 +246,18 @@ def _form_contenido():
 
             st.success(f"Corregido · exam_id: `{exam_id}` · student_id: `{student_id}`")
 
-            answers_detail = result.get("answers", [])
-            correct = result.get("correct_count")
-            incorrect = result.get("incorrect_count")
-            answered_count = result.get("answered_count")
-            omitted_count = result.get("omitted_count")
-            percent = result.get("percent_correct")
-
-            if answers_detail and (answered_count is None or omitted_count is None or correct is None or incorrect is None or percent is None):
-                det = []
-                for a in answers_detail:
-                    q = a.get("q") or a.get("question")
-                    sv = a.get("value") or a.get("studentValue")
-                    cv = a.get("correctValue")
-                    ic = a.get("isCorrect")
-                    det.append({"q": q, "studentValue": sv, "correctValue": cv,
-                                "isCorrect": bool(ic) if ic is not None else (
-                                    str(sv).upper()==str(cv).upper() if (sv and cv) else False)})
-                answered_count = sum(1 for d in det if d["studentValue"] is not None)
-                correct = sum(1 for d in det if d["isCorrect"])
-                incorrect = answered_count - correct
-                percent = round((correct/answered_count)*100, 2) if answered_count else 0.0
-                omitted_count = omitted_count if omitted_count is not None else 0
-                answers_detail = det
-
-            insert_result(
-                student_id=result.get("student_id", student_id),
-                exam_id=result.get("exam_id", exam_id),
-                correct=correct or 0,
-                incorrect=incorrect or 0,
-                percent=percent or 0.0,
-                timestamp=datetime.now().isoformat(),
-                answered_count=answered_count or 0,
-                omitted_count=omitted_count or 0,
-                answers_json=json.dumps(answers_detail or [])
-            )
-            st.toast("Resultado guardado y dashboard actualizado", icon="✅")
-            st.session_state["_refresh"] = True
-            st.rerun()
+            if DIRECT_INGEST:
+                st.toast("n8n guarda el resultado (ingesta directa); el Resumen se actualiza solo", icon="✅")
+            else:
+                row = normalize_result(result, student_id=student_id, exam_id=exam_id,
+                                       timestamp=datetime.now().isoformat())
+                insert_result(**row)
+                st.toast("Resultado guardado y dashboard actualizado", icon="✅")
+            # El Resumen se actualiza solo (ver resumen_en_vivo); solo se recarga
+            # la página completa si todavía no había datos que mostrar.
+            all_cached = st.session_state.get("_results_cache", {}).get("all")
+            if all_cached is None or all_cached["df"].empty:
+                st.rerun()
         except Exception as e:
             st.error(f"Fallo al comunicarse con n8n: {e}")
 
@@ -305,6 +282,78 @@ def boton_modal():
                 st.session_state.show_modal = False; st.rerun()
             st.markdown("</div></div>", unsafe_allow_html=True)
 
+# ---------- Datos en caché por sesión (carga incremental) ----------
+def _results(key: str, **filters) -> dict:
+    """
+    Resultados de load_data(**filters) guardados en la sesión. En cada llamada
+    solo se consulta results_version(); si solo llegaron filas nuevas se leen
+    únicamente esas y se agregan, y si hubo borrados se recarga todo.
+    Devuelve {"df", "version", ...}; version sube con cada cambio.
+    """
+    cache = st.session_state.setdefault("_results_cache", {})
+    entry = cache.get(key)
+    max_id, deletes = results_version()
+    if entry is None or entry["filters"] != filters or deletes != entry["deletes"] or max_id < entry["last_id"]:
+        version = entry["version"] + 1 if entry else 0
+        entry = {"filters": filters, "df": load_data(**filters), "last_id": max_id,
+                 "deletes": deletes, "version": version}
+        cache[key] = entry
+    elif max_id > entry["last_id"]:
+        new_rows = load_data(**filters, min_id=entry["last_id"])
+        entry["last_id"] = max_id
+        if not new_rows.empty:
+            entry["df"] = append_results(entry["df"], new_rows)
+            entry["version"] += 1
+    return entry
+
+def _resumen_chart(df_filtered: pd.DataFrame, cache_key) -> bytes:
+    """PNG de los gráficos del Resumen; se reutiliza mientras no cambien los datos."""
+    cached = st.session_state.get("_resumen_chart")
+    if cached and cached[0] == cache_key:
+        return cached[1]
+
+    plt.style.use("seaborn-v0_8-whitegrid")
+    fig, axes = plt.subplots(1, 2, figsize=(12, 4))
+    axes[0].hist(df_filtered["percent_correct"], bins=10, edgecolor="black")
+    axes[0].set_title("Distribución de porcentajes de aciertos"); axes[0].set_xlabel("Porcentaje"); axes[0].set_ylabel("Frecuencia")
+
+    df_sorted = df_filtered.sort_values("percent_correct", ascending=False)
+    axes[1].bar(df_sorted["student_id"], df_sorted["percent_correct"])
+    axes[1].set_title("Ranking de desempeño"); axes[1].set_xlabel("Estudiante"); axes[1].set_ylabel("Porcentaje (%)")
+    axes[1].tick_params(axis="x", rotation=45)
+    plt.tight_layout()
+
+    buf = BytesIO()
+    fig.savefig(buf, format="png", dpi=150)
+    plt.close(fig)
+    st.session_state["_resumen_chart"] = (cache_key, buf.getvalue())
+    return buf.getvalue()
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def resumen_en_vivo(filters: dict, student_filter: list):
+    """
+    KPIs y gráficos del Resumen. Corre como fragmento: se re-ejecuta solo cada
+    REFRESH_SECONDS y redibuja los gráficos únicamente si hay filas nuevas.
+    """
+    entry = _results("filtered", **filters)
+    df_filtered = entry["df"]
+    if student_filter:
+        df_filtered = df_filtered[df_filtered["student_id"].isin(student_filter)]
+    if df_filtered.empty:
+        st.warning("No hay resultados que coincidan con los filtros.")
+        return
+
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        st.markdown(f'<div class="kpi"><h4>Registros</h4><div class="val">{len(df_filtered)}</div></div>', unsafe_allow_html=True)
+    with c2:
+        st.markdown(f'<div class="kpi"><h4>Máximo (%)</h4><div class="val">{df_filtered["percent_correct"].max():.2f}</div></div>', unsafe_allow_html=True)
+    with c3:
+        st.markdown(f'<div class="kpi"><h4>Mínimo (%)</h4><div class="val">{df_filtered["percent_correct"].min():.2f}</div></div>', unsafe_allow_html=True)
+
+    chart_key = (repr(sorted(filters.items())), entry["version"], tuple(student_filter))
+    st.image(_resumen_chart(df_filtered, chart_key), use_container_width=True)
+
 # ---------- Exportadores ----------
 def export_pdf(df, stats, fig_buffer) -> BytesIO:
     pdf = FPDF()
@@ -379,14 +428,16 @@ def make_exports(df_filtered: pd.DataFrame):
 
     pdf_bytes = export_pdf(df_filtered, stats, fig_buf)
 
-    csv_results = df_filtered.to_csv(index=False).encode("utf-8")
-    detail_df = explode_answers(df_filtered)
+    # answers_json solo se lee aquí (exportación), para las filas filtradas
+    df_export = attach_answers(df_filtered)
+    csv_results = df_export.to_csv(index=False).encode("utf-8")
+    detail_df = explode_answers(df_export)
     csv_detail = detail_df.to_csv(index=False).encode("utf-8")
 
     xls_buf = BytesIO()
     with pd.ExcelWriter(xls_buf, engine="xlsxwriter") as writer:
         pd.DataFrame([stats]).to_excel(writer, sheet_name="Resumen", index=False)
-        df_filtered.to_excel(writer, sheet_name="Resultados", index=False)
+        df_export.to_excel(writer, sheet_name="Resultados", index=False)
         detail_df.to_excel(writer, sheet_name="DetallePreguntas", index=False)
     xls_buf.seek(0)
 
@@ -422,7 +473,7 @@ def main():
         st.stop()
 
     try:
-        df = load_data()
+        df = _results("all")["df"]
     except Exception as e:
         st.error(f"Error al leer la base de datos: {e}")
         st.stop()
@@ -432,6 +483,12 @@ def main():
         st.sidebar.markdown('</div>', unsafe_allow_html=True)
         st.stop()
 
+    # Filas con timestamp no interpretable: no entran en los filtros por fecha
+    sin_epoch = int(df["ts_epoch"].isna().sum())
+    if sin_epoch:
+        st.warning(f"{sin_epoch} registros tienen una fecha no válida y no aparecen al filtrar por fecha "
+                   f"(detalle: python analyze_results_sqlite.py --sin-epoch).")
+
     # Filtros reales
     exams = sorted(df["exam_id"].unique().tolist())
     exam_filter = st.sidebar.multiselect("Examen", exams, default=exams)
@@ -439,15 +496,30 @@ def main():
     students_pool = df[df["exam_id"].isin(exam_filter)]["student_id"].unique().tolist()
     student_filter = st.sidebar.multiselect("Estudiante (opcional)", sorted(students_pool), default=[])
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    dmin, dmax = df["timestamp"].min().date(), df["timestamp"].max().date()
+    # Rango de fechas desde ts_epoch (sin parsear la columna de texto)
+    dmin = datetime.fromtimestamp(int(df["ts_epoch"].min())).date()
+    dmax = datetime.fromtimestamp(int(df["ts_epoch"].max())).date()
     date_range = st.sidebar.date_input("Rango de fechas", (dmin, dmax), min_value=dmin, max_value=dmax)
+    if not isinstance(date_range, (tuple, list)):
+        date_range = (date_range, date_range)
+    elif len(date_range) == 1:
+        date_range = (date_range[0], date_range[0])
 
     st.sidebar.markdown('</div>', unsafe_allow_html=True)
 
-    df_filtered = df[(df["exam_id"].isin(exam_filter)) &
-                     (df["timestamp"].dt.date >= date_range[0]) &
-                     (df["timestamp"].dt.date <= date_range[1])]
+    # Filtro examen + fecha resuelto en SQLite con el índice (exam_id, ts_epoch).
+    # Si están todos los exámenes o el rango llega hasta el final, el filtro queda
+    # abierto para que los resultados nuevos (otros exámenes, hoy) entren en vivo.
+    filters = {
+        "exam_ids": None if set(exam_filter) == set(exams) else list(exam_filter),
+        "start_epoch": None if date_range[0] <= dmin else date_to_epoch(date_range[0]),
+        "end_epoch": None if date_range[1] >= dmax else date_to_epoch(date_range[1], end=True),
+    }
+    try:
+        df_filtered = _results("filtered", **filters)["df"]
+    except Exception as e:
+        st.error(f"Error al leer la base de datos: {e}")
+        st.stop()
     if student_filter:
         df_filtered = df_filtered[df_filtered["student_id"].isin(student_filter)]
 
@@ -458,41 +530,40 @@ def main():
     tab1, tab2, tab3 = st.tabs(["📊 Resumen", "🧑‍🎓 Exámenes y estudiantes", "📄 Datos & Exportar"])
 
     with tab1:
-        c1, c2, c3 = st.columns(3)
-        with c1:
-            st.markdown(f'<div class="kpi"><h4>Registros</h4><div class="val">{len(df_filtered)}</div></div>', unsafe_allow_html=True)
-        with c2:
-            st.markdown(f'<div class="kpi"><h4>Máximo (%)</h4><div class="val">{df_filtered["percent_correct"].max():.2f}</div></div>', unsafe_allow_html=True)
-        with c3:
-            st.markdown(f'<div class="kpi"><h4>Mínimo (%)</h4><div class="val">{df_filtered["percent_correct"].min():.2f}</div></div>', unsafe_allow_html=True)
-
-        plt.style.use("seaborn-v0_8-whitegrid")
-        fig, axes = plt.subplots(1, 2, figsize=(12, 4))
-        axes[0].hist(df_filtered["percent_correct"], bins=10, edgecolor="black")
-        axes[0].set_title("Distribución de porcentajes de aciertos"); axes[0].set_xlabel("Porcentaje"); axes[0].set_ylabel("Frecuencia")
-
-        df_sorted = df_filtered.sort_values("percent_correct", ascending=False)
-        axes[1].bar(df_sorted["student_id"], df_sorted["percent_correct"])
-        axes[1].set_title("Ranking de desempeño"); axes[1].set_xlabel("Estudiante"); axes[1].set_ylabel("Porcentaje (%)")
-        axes[1].tick_params(axis="x", rotation=45)
-        plt.tight_layout()
-        st.pyplot(fig, use_container_width=True)
+        resumen_en_vivo(filters, student_filter)
 
     with tab2:
         st.subheader("Estudiantes por Examen")
         summary = (
             df
-            .groupby("exam_id", as_index=False)
+            .groupby("exam_id", as_index=False, observed=True)
             .agg(estudiantes=("student_id", lambda s: ", ".join(sorted(set(s)))),
                  conteo=("student_id", "nunique"))
             .sort_values("exam_id")
         )
         st.dataframe(summary, use_container_width=True)
 
+        # Resultados antiguos movidos al archivo (solo quedan sus agregados)
+        try:
+            historico = load_aggregates()
+        except Exception:
+            historico = pd.DataFrame()
+        if not historico.empty:
+            st.subheader("Histórico archivado (por mes)")
+            st.dataframe(historico.rename(columns={
+                "exam_id": "Examen", "period": "Mes", "n_results": "Registros",
+                "avg_percent": "Promedio (%)", "min_percent": "Mínimo (%)", "max_percent": "Máximo (%)",
+                "sum_correct": "Correctas", "sum_incorrect": "Incorrectas",
+            }), use_container_width=True)
+
         st.subheader("Detalle por Examen y Estudiante")
-        for ex_id, sub in df.sort_values(["exam_id","timestamp"]).groupby("exam_id"):
+        # answers_json solo del último registro de cada (examen, estudiante)
+        latest_ids = (df.sort_values(["ts_epoch", "id"])
+                        .groupby(["exam_id", "student_id"], observed=True)["id"].last())
+        answers_by_id = load_answers(latest_ids.tolist())
+        for ex_id, sub in df.sort_values(["exam_id","timestamp"]).groupby("exam_id", observed=True):
             with st.expander(f"Examen: {ex_id} · Registros: {len(sub)} · Estudiantes: {sub['student_id'].nunique()}"):
-                for sid, srows in sub.sort_values("timestamp").groupby("student_id"):
+                for sid, srows in sub.sort_values(["ts_epoch", "id"]).groupby("student_id", observed=True):
                     row = srows.iloc[-1]
                     correct = int(row.get("correct_count") or 0)
                     incorrect = int(row.get("incorrect_count") or 0)
@@ -500,24 +571,18 @@ def main():
                     omitted = int(row.get("omitted_count") or 0)
                     percent = float(row.get("percent_correct") or 0.0)
 
-                    answers_detail = []
-                    try:
-                        aj = row.get("answers_json")
-                        if pd.notna(aj) and str(aj).strip() != "":
-                            answers_detail = json.loads(aj)
-                    except Exception:
-                        answers_detail = []
+                    answers_detail = answers_by_id.get(int(row["id"])) or []
 
                     if answers_detail and (answered == 0 and omitted == 0):
                         answered = sum(1 for a in answers_detail if (a.get("value") or a.get("studentValue")) is not None)
                         incorrect = sum(1 for a in answers_detail
                                         if (a.get("isCorrect") is False) or (
-                                            a.get("isCorrect") is None and a.get("value") and a.get("correctValue")
-                                            and str(a.get("value")).upper()!=str(a.get("correctValue")).upper()))
+                                            a.get("isCorrect") is None and (a.get("value") or a.get("studentValue")) and a.get("correctValue")
+                                            and str(a.get("value") or a.get("studentValue")).upper()!=str(a.get("correctValue")).upper()))
                         correct = sum(1 for a in answers_detail
                                       if (a.get("isCorrect") is True) or (
-                                          a.get("isCorrect") is None and a.get("value") and a.get("correctValue")
-                                          and str(a.get("value")).upper()==str(a.get("correctValue")).upper()))
+                                          a.get("isCorrect") is None and (a.get("value") or a.get("studentValue")) and a.get("correctValue")
+                                          and str(a.get("value") or a.get("studentValue")).upper()==str(a.get("correctValue")).upper()))
                         if answered and (correct+incorrect)==answered:
                             percent = round((correct/answered)*100, 2)
 
@@ -0,0 +1,319 @@
+# ingest_server.py
+# Servicio HTTP mínimo para que el flujo de n8n envíe los resultados corregidos
+# directamente a results.db, sin depender de la sesión de Streamlit.
+#
+#   python ingest_server.py --port 8600
+#   POST /results  (JSON: un resultado o una lista de resultados)
+#   GET  /health
+#
+# Los reintentos son idempotentes: un resultado con "idempotency_key" (o con su
+# propio "timestamp", ver normalize_result) que ya está en la BD no se vuelve a
+# insertar. Con este servicio en uso, el panel se levanta con DIRECT_INGEST=1
+# para no guardar dos veces lo corregido desde la interfaz.
+#
+# Las escrituras pasan por un "group commit": las peticiones que llegan casi al
+# mismo tiempo se insertan juntas en una sola transacción, y cada petición
+# responde recién cuando su lote quedó confirmado en la BD.
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+
+import tornado.web
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+from analyze_results_sqlite import DB_PATH, init_db, insert_results, normalize_result
+
+DEFAULT_PORT = 8600
+# Si está definido, cada POST debe traer el header X-Ingest-Token con este valor
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN")
+
+
+# ---------- Group commit ----------
+class GroupCommitWriter:
+    """
+    Junta filas de varias peticiones y las inserta en lotes de hasta max_batch
+    filas. Espera como máximo max_delay segundos para llenar un lote.
+    SQLite se usa desde un único hilo dedicado para no bloquear el IOLoop.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, max_batch: int = 2000, max_delay: float = 0.005):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.rows_written = 0
+        self._pending = deque()  # (filas, future)
+        self._pending_rows = 0
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+        self._conn = None
+        self._task = None
+
+    def _open(self):
+        init_db(self.db_path)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # WAL: los lectores del dashboard no bloquean (ni son bloqueados por) el writer
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        return conn
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._conn = await loop.run_in_executor(self._executor, self._open)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        while self._pending:
+            await self._flush()
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, rows: list) -> int:
+        """Encola filas y espera a que su lote quede confirmado."""
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((rows, fut))
+        self._pending_rows += len(rows)
+        self._wakeup.set()
+        return await fut
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if self._pending_rows < self.max_batch:
+                await asyncio.sleep(self.max_delay)
+            self._wakeup.clear()
+            while self._pending:
+                await self._flush()
+
+    async def _flush(self):
+        batch, n = [], 0
+        while self._pending and (not batch or n + len(self._pending[0][0]) <= self.max_batch):
+            rows, fut = self._pending.popleft()
+            batch.append((rows, fut))
+            n += len(rows)
+        self._pending_rows -= n
+        flat = [r for rows, _ in batch for r in rows]
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, insert_results, flat, self.db_path, self._conn)
+        except Exception:
+            # El lote se revirtió completo: se reintenta cada petición por separado
+            # para que una sola fila mala no haga fallar a las demás.
+            for rows, fut in batch:
+                try:
+                    await loop.run_in_executor(self._executor, insert_results, rows, self.db_path, self._conn)
+                except Exception as e:
+                    if not fut.done():
+                        fut.set_exception(e)
+                    continue
+                self.batches += 1
+                self.rows_written += len(rows)
+                if not fut.done():
+                    fut.set_result(len(rows))
+            return
+        self.batches += 1
+        self.rows_written += n
+        for rows, fut in batch:
+            if not fut.done():
+                fut.set_result(len(rows))
+
+
+# ---------- Handlers ----------
+class BaseHandler(tornado.web.RequestHandler):
+    def write_json(self, status: int, payload: dict):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(payload, ensure_ascii=False))
+
+
+class ResultsHandler(BaseHandler):
+    def initialize(self, writer: GroupCommitWriter):
+        self.writer = writer
+
+    async def post(self):
+        token = self.request.headers.get("X-Ingest-Token") or ""
+        if INGEST_TOKEN and not hmac.compare_digest(token.encode("utf-8"), INGEST_TOKEN.encode("utf-8")):
+            return self.write_json(401, {"ok": False, "error": "Token inválido."})
+        try:
+            body = json.loads(self.request.body or b"null")
+        except ValueError:
+            return self.write_json(400, {"ok": False, "error": "El cuerpo no es JSON válido."})
+
+        items = body if isinstance(body, list) else [body]
+        if not items:
+            return self.write_json(400, {"ok": False, "error": "No hay resultados."})
+        rows, errors = [], []
+        for i, item in enumerate(items):
+            try:
+                rows.append(normalize_result(item))
+            except ValueError as e:
+                errors.append({"index": i, "error": str(e)})
+        if errors:
+            return self.write_json(400, {"ok": False, "errores": errors})
+
+        try:
+            saved = await self.writer.submit(rows)
+        except Exception as e:
+            return self.write_json(500, {"ok": False, "error": f"No se pudo guardar: {e}"})
+        self.write_json(200, {"ok": True, "guardados": saved})
+
+
+class HealthHandler(BaseHandler):
+    def initialize(self, writer: GroupCommitWriter):
+        self.writer = writer
+
+    def get(self):
+        self.write_json(200, {"ok": True, "lotes": self.writer.batches, "filas": self.writer.rows_written})
+
+
+def make_app(writer: GroupCommitWriter) -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/results", ResultsHandler, {"writer": writer}),
+        (r"/health", HealthHandler, {"writer": writer}),
+    ])
+
+
+# ---------- Servidor ----------
+def _is_loopback(address: str) -> bool:
+    if address == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+async def serve(db_path: str = DB_PATH, port: int = DEFAULT_PORT, address: str = "127.0.0.1"):
+    """
+    Sirve /results y /health. Fuera de loopback exige INGEST_TOKEN: sin él
+    cualquiera en la red podría escribir resultados en la BD.
+    """
+    if not INGEST_TOKEN and not _is_loopback(address):
+        raise ValueError(f"Definí INGEST_TOKEN para escuchar en {address} (solo se permite sin token en loopback).")
+    writer = GroupCommitWriter(db_path)
+    await writer.start()
+    app = make_app(writer)
+    server = app.listen(port, address=address, xheaders=True)
+    print(f"📥 Ingesta escuchando en http://{address}:{port}/results (BD: {db_path})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        await writer.stop()
+
+
+# ---------- Prueba de carga local ----------
+def _sample_result(i: int) -> dict:
+    return {
+        "exam_id": f"bench_{i % 20:02d}",
+        "student_id": f"est{i:06d}",
+        "answers": [
+            {"q": q, "studentValue": "ABCD"[(i + q) % 4], "correctValue": "ABCD"[q % 4]}
+            for q in range(1, 21)
+        ],
+    }
+
+
+async def _bench_requests(url: str, total: int, concurrency: int) -> int:
+    client = AsyncHTTPClient(max_clients=concurrency)
+    queue = iter(range(total))
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        for i in queue:
+            req = HTTPRequest(url, method="POST", body=json.dumps(_sample_result(i)),
+                              headers={"Content-Type": "application/json",
+                                       "X-Ingest-Token": INGEST_TOKEN or ""})
+            resp = await client.fetch(req, raise_error=False)
+            if resp.code != 200:
+                failures += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    client.close()
+    return failures
+
+
+def _bench_client(url: str, total: int, concurrency: int) -> tuple:
+    """Cliente del benchmark (corre en otro proceso). Devuelve (fallidos, segundos)."""
+    t0 = perf_counter()
+    failures = asyncio.run(_bench_requests(url, total, concurrency))
+    return failures, perf_counter() - t0
+
+
+async def bench(db_path: str, total: int = 5000, concurrency: int = 200) -> dict:
+    """
+    Levanta el servicio en este proceso (puerto libre) y le envía `total` POSTs
+    con `concurrency` clientes simultáneos desde un proceso aparte, para que el
+    cliente no compita por el mismo IOLoop/GIL. Devuelve posts/s y lotes usados.
+    """
+    writer = GroupCommitWriter(db_path)
+    await writer.start()
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    server = HTTPServer(make_app(writer))
+    server.add_sockets(sockets)
+    url = f"http://127.0.0.1:{port}/results"
+    try:
+        # spawn: no heredar por fork el hilo del writer ni el IOLoop en marcha
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            failures, elapsed = await asyncio.get_running_loop().run_in_executor(
+                pool, _bench_client, url, total, concurrency)
+    finally:
+        server.stop()
+        await writer.stop()
+    return {
+        "POSTs": total,
+        "Fallidos": failures,
+        "Tiempo (s)": round(elapsed, 2),
+        "POSTs/s": round(total / elapsed, 1) if elapsed else 0.0,
+        "Lotes (commits)": writer.batches,
+        "Filas por lote": round(writer.rows_written / writer.batches, 1) if writer.batches else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio de ingesta de resultados (n8n -> SQLite).")
+    parser.add_argument("--db", default=DB_PATH, help="Ruta a la base de datos")
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección donde escuchar")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Puerto HTTP")
+    parser.add_argument("--bench", type=int, default=0, metavar="N",
+                        help="En vez de servir, envía N POSTs locales a una BD temporal y mide el rendimiento")
+    parser.add_argument("--concurrencia", type=int, default=200, help="Clientes simultáneos para --bench")
+    args = parser.parse_args()
+
+    if args.bench:
+        with tempfile.TemporaryDirectory() as tmp:
+            summary = asyncio.run(bench(os.path.join(tmp, "bench.db"), args.bench, args.concurrencia))
+        print("📈 Ingesta:")
+        for k, v in summary.items():
+            print(f"  {k}: {v}")
+        return
+    try:
+        asyncio.run(serve(args.db, args.port, args.host))
+    except ValueError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
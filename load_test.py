@@ -0,0 +1,262 @@
+# load_test.py
+# Prueba de carga del dashboard y del camino de escritura contra SQLite.
+#
+# Simula N sesiones de dashboard (las mismas funciones de datos/filtros/export
+# que usa main() en analyze_results_streamlit_secure.py) y M correctores que
+# envían el examen a un webhook local de reemplazo y guardan el resultado como
+# lo hace _form_contenido. Todo corre en hilos de un mismo proceso, igual que
+# las sesiones de Streamlit.
+#
+#   python load_test.py --sesiones 20 --correctores 5 --duracion 30
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from time import perf_counter, sleep
+
+import pandas as pd
+import requests
+
+from analyze_results_sqlite import (
+    attach_answers, date_to_epoch, explode_answers, init_db, insert_result, insert_results,
+    load_answers, load_data, next_student_seq_for_exam, normalize_result, results_version
+)
+
+N_QUESTIONS = 20
+
+
+# ---------- Webhook de reemplazo (corrector) ----------
+class _StandInGrader(BaseHTTPRequestHandler):
+    """Responde como el webhook de n8n: un resultado corregido con detalle por pregunta."""
+    delay = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.delay:
+            sleep(self.delay)
+        body = json.dumps({"answers": _random_answers()}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _random_answers() -> list:
+    return [{"q": q, "studentValue": random.choice("ABCD"), "correctValue": "ABCD"[q % 4]}
+            for q in range(1, N_QUESTIONS + 1)]
+
+
+def seed_db(db_path: str, rows: int, exams: int = 30, days: int = 365):
+    """Llena la BD con resultados sintéticos repartidos en `days` días."""
+    init_db(db_path)
+    now = datetime.now()
+    batch = []
+    for i in range(rows):
+        ts = (now - timedelta(seconds=random.randint(0, days * 86400))).isoformat()
+        batch.append(normalize_result({"answers": _random_answers()},
+                                      student_id=f"est{i:06d}", exam_id=f"examen_{i % exams:02d}",
+                                      timestamp=ts))
+        if len(batch) >= 5000:
+            insert_results(batch, db_path)
+            batch = []
+    if batch:
+        insert_results(batch, db_path)
+
+
+# ---------- Métricas ----------
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.locked = {}
+        self.errors = {}
+
+    def record(self, op: str, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(op, []).append(seconds)
+
+    def error(self, op: str, exc: Exception):
+        with self._lock:
+            if isinstance(exc, sqlite3.OperationalError) and "locked" in str(exc).lower():
+                self.locked[op] = self.locked.get(op, 0) + 1
+            else:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def timed(self, op: str, fn, *args, **kwargs) -> tuple:
+        """Ejecuta fn midiendo su latencia. Devuelve (ok, resultado)."""
+        t0 = perf_counter()
+        try:
+            out = fn(*args, **kwargs)
+        except Exception as e:
+            self.error(op, e)
+            return False, None
+        self.record(op, perf_counter() - t0)
+        return True, out
+
+    def report(self, elapsed: float) -> pd.DataFrame:
+        ops = sorted(set(self.latencies) | set(self.locked) | set(self.errors))
+        rows = []
+        for op in ops:
+            lat = sorted(self.latencies.get(op, []))
+            pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 1) if lat else None
+            rows.append({
+                "operación": op,
+                "ok": len(lat),
+                "ops/s": round(len(lat) / elapsed, 1) if elapsed else 0.0,
+                "p50 (ms)": pct(0.50),
+                "p95 (ms)": pct(0.95),
+                "p99 (ms)": pct(0.99),
+                "database is locked": self.locked.get(op, 0),
+                "otros errores": self.errors.get(op, 0),
+            })
+        return pd.DataFrame(rows)
+
+
+# ---------- Actores ----------
+def dashboard_session(db_path: str, metrics: Metrics, stop: threading.Event, think: float):
+    """
+    Repite el recorrido de main(): consulta de versión (la que hace _results en
+    cada rerun/refresco), carga, filtros, detalle (tab2) y exportación (tab3).
+    """
+    while not stop.is_set():
+        t0 = perf_counter()
+        metrics.timed("dashboard: results_version", results_version, db_path)
+        ok, df = metrics.timed("dashboard: load_data", load_data, db_path)
+        if not ok or df.empty:
+            sleep(think or 0.1)
+            continue
+
+        exams = sorted(df["exam_id"].unique().tolist())
+        exam_filter = random.sample(exams, k=max(1, len(exams) // 3))
+        dmax = datetime.fromtimestamp(int(df["ts_epoch"].max())).date()
+        start = dmax - timedelta(days=random.randint(7, 90))
+        ok, df_filtered = metrics.timed("dashboard: filtro", load_data, db_path, exam_ids=exam_filter,
+                                        start_epoch=date_to_epoch(start),
+                                        end_epoch=date_to_epoch(dmax, end=True))
+
+        latest_ids = (df.sort_values(["ts_epoch", "id"])
+                        .groupby(["exam_id", "student_id"], observed=True)["id"].last())
+        metrics.timed("dashboard: detalle", load_answers, latest_ids.tolist()[:500], db_path)
+
+        if ok and not df_filtered.empty:
+            metrics.timed("dashboard: export", _export, df_filtered, db_path)
+        metrics.record("dashboard: sesión completa", perf_counter() - t0)
+        if think:
+            sleep(think)
+
+
+def _export(df_filtered: pd.DataFrame, db_path: str):
+    # Mismo trabajo de datos que make_exports (CSV resultados + detalle + XLSX)
+    df_export = attach_answers(df_filtered, db_path)
+    df_export.to_csv(index=False)
+    detail_df = explode_answers(df_export)
+    detail_df.to_csv(index=False)
+    buf = BytesIO()
+    with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
+        df_export.to_excel(writer, sheet_name="Resultados", index=False)
+        detail_df.to_excel(writer, sheet_name="DetallePreguntas", index=False)
+
+
+def grader(db_path: str, webhook_url: str, metrics: Metrics, stop: threading.Event, think: float):
+    """Igual que _form_contenido: siguiente estNN, POST al webhook, normaliza e inserta."""
+    session = requests.Session()
+    payload = os.urandom(200_000)
+    while not stop.is_set():
+        t0 = perf_counter()
+        exam_id = f"examen_{random.randint(0, 29):02d}"
+        ok, seq = metrics.timed("corrector: next_student_seq", next_student_seq_for_exam, exam_id, db_path)
+        student_id = f"est{seq if ok else 1:02d}"
+        ok, resp = metrics.timed("corrector: webhook", session.post, webhook_url,
+                                 data={"student_id": student_id, "exam_id": exam_id, "answer_key": "{}"},
+                                 files={"exam_file": ("hoja.jpg", payload, "image/jpeg")}, timeout=90)
+        if not ok or resp.status_code != 200:
+            continue
+        ok, row = metrics.timed("corrector: normalize_result",
+                                lambda: normalize_result(resp.json(), student_id=student_id, exam_id=exam_id,
+                                                         timestamp=datetime.now().isoformat()))
+        if not ok:
+            continue
+        ok, _ = metrics.timed("corrector: insert_result", insert_result, **row, db_path=db_path)
+        if ok:
+            metrics.record("corrector: envío completo", perf_counter() - t0)
+        if think:
+            sleep(think)
+
+
+# ---------- Orquestación ----------
+def _copy_db(src: str, dst: str):
+    """Copia consistente con la API de backup (incluye lo que aún esté en el -wal)."""
+    source, target = sqlite3.connect(src), sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def run(sessions: int, graders: int, duration: float, db_path: str = None, seed_rows: int = 20_000,
+        webhook_delay: float = 0.0, think: float = 0.0) -> pd.DataFrame:
+    """
+    Ejecuta la prueba sobre una copia temporal de la BD (o una BD sintética con
+    seed_rows filas) para no tocar results.db. Devuelve la tabla de métricas.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        work_db = os.path.join(tmp, "loadtest.db")
+        if db_path:
+            _copy_db(db_path, work_db)
+            init_db(work_db)
+        else:
+            seed_db(work_db, seed_rows)
+
+        _StandInGrader.delay = webhook_delay
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInGrader)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        webhook_url = f"http://127.0.0.1:{server.server_address[1]}/webhook"
+
+        metrics, stop = Metrics(), threading.Event()
+        threads = [threading.Thread(target=dashboard_session, args=(work_db, metrics, stop, think), daemon=True)
+                   for _ in range(sessions)]
+        threads += [threading.Thread(target=grader, args=(work_db, webhook_url, metrics, stop, think), daemon=True)
+                    for _ in range(graders)]
+        t0 = perf_counter()
+        for t in threads:
+            t.start()
+        sleep(duration)
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = perf_counter() - t0
+        server.shutdown()
+        return metrics.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga: sesiones de dashboard + correctores sobre SQLite.")
+    parser.add_argument("--sesiones", type=int, default=10, help="Sesiones de dashboard simultáneas (N)")
+    parser.add_argument("--correctores", type=int, default=4, help="Correctores escribiendo resultados (M)")
+    parser.add_argument("--duracion", type=float, default=30.0, help="Segundos de prueba")
+    parser.add_argument("--db", default=None, help="BD a copiar como punto de partida (por defecto, sintética)")
+    parser.add_argument("--filas", type=int, default=20_000, help="Filas sintéticas si no se usa --db")
+    parser.add_argument("--latencia-webhook", type=float, default=0.0,
+                        help="Segundos que tarda el webhook de reemplazo en corregir")
+    parser.add_argument("--pausa", type=float, default=0.0, help="Pausa entre acciones de cada actor (s)")
+    args = parser.parse_args()
+
+    report = run(args.sesiones, args.correctores, args.duracion, args.db, args.filas,
+                 args.latencia_webhook, args.pausa)
+    print(f"📊 {args.sesiones} sesiones · {args.correctores} correctores · {args.duracion:.0f} s")
+    print(report.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# upload_preprocess.py
+# Preprocesa la hoja de respuestas antes de enviarla al webhook de corrección:
+# orienta según EXIF, pasa a escala de grises, reduce a un DPI objetivo y
+# recodifica (JPEG/PNG) dentro de un presupuesto de bytes.
+#
+#   python upload_preprocess.py --bench foto1.jpg foto2.png --mbps 20
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter, sleep
+
+from PIL import Image, ImageOps
+
+# Ajustes por defecto (se pueden sobreescribir por llamada con settings={...})
+UPLOAD_SETTINGS = {
+    "enabled": True,
+    "grayscale": True,
+    "target_dpi": 150,         # resolución final suponiendo una hoja de page_long_in pulgadas
+    "page_long_in": 11.0,      # lado largo de la hoja (carta)
+    "max_bytes": 1_500_000,    # presupuesto por archivo
+    "jpeg_quality": 85,
+    "min_jpeg_quality": 45,
+}
+
+IMAGE_MIMES = {"image/jpeg", "image/png"}
+
+
+def _settings(overrides: dict = None) -> dict:
+    s = dict(UPLOAD_SETTINGS)
+    s.update(overrides or {})
+    return s
+
+
+def _flatten_alpha(img: Image.Image) -> Image.Image:
+    """
+    Pega las imágenes con transparencia sobre fondo blanco. Si no, convert("L")
+    descarta el alfa y el fondo transparente (RGB 0) queda negro.
+    """
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA", "PA"):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img
+
+
+def _downsample(img: Image.Image, max_long_px: int) -> Image.Image:
+    long_side = max(img.size)
+    if long_side <= max_long_px:
+        return img
+    scale = max_long_px / long_side
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+def _encode_jpeg(img: Image.Image, quality: int, dpi: int) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True, dpi=(dpi, dpi))
+    return buf.getvalue()
+
+
+def _encode_png(img: Image.Image, dpi: int) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format="PNG", optimize=True, dpi=(dpi, dpi))
+    return buf.getvalue()
+
+
+def preprocess_exam_file(file_bytes: bytes, mime: str, filename: str, settings: dict = None) -> tuple:
+    """
+    Devuelve (bytes, mime, filename) listos para el POST al webhook.
+    Solo procesa imágenes JPEG/PNG; los PDF y otros tipos se envían tal cual.
+    Si el resultado no es más chico que el original, se conserva el original.
+    """
+    s = _settings(settings)
+    mime = (mime or "").lower()
+    if not s["enabled"] or mime not in IMAGE_MIMES:
+        return file_bytes, mime, filename
+
+    img = Image.open(BytesIO(file_bytes))
+    img = ImageOps.exif_transpose(img)
+    img = _flatten_alpha(img)
+    if s["grayscale"]:
+        img = img.convert("L")
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    dpi = int(s["target_dpi"])
+    max_long_px = int(dpi * s["page_long_in"])
+    budget = int(s["max_bytes"])
+    stem = Path(filename).stem
+
+    # PNG (escaneos limpios): se intenta sin pérdida primero
+    if mime == "image/png":
+        out = _encode_png(_downsample(img, max_long_px), dpi)
+        if len(out) <= budget:
+            return _smaller(out, "image/png", f"{stem}.png", file_bytes, mime, filename)
+
+    # JPEG: baja la calidad y, si no alcanza, la resolución, hasta entrar en el presupuesto
+    out = None
+    for _ in range(4):
+        work = _downsample(img, max_long_px)
+        quality = int(s["jpeg_quality"])
+        while True:
+            out = _encode_jpeg(work, quality, dpi)
+            if len(out) <= budget or quality <= s["min_jpeg_quality"]:
+                break
+            quality = max(int(s["min_jpeg_quality"]), quality - 10)
+        if len(out) <= budget:
+            break
+        max_long_px = int(max_long_px * 0.8)
+    return _smaller(out, "image/jpeg", f"{stem}.jpg", file_bytes, mime, filename)
+
+
+def _smaller(out, out_mime, out_name, file_bytes, mime, filename) -> tuple:
+    if len(out) < len(file_bytes):
+        return out, out_mime, out_name
+    return file_bytes, mime, filename
+
+
+# ---------- Benchmark contra un webhook local ----------
+class _StandInWebhook(BaseHTTPRequestHandler):
+    """Imita al webhook de n8n: lee el multipart completo y responde un JSON fijo."""
+    bytes_per_sec = None  # None = sin límite de ancho de banda
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if self.bytes_per_sec:
+            sleep(length / self.bytes_per_sec)
+        body = json.dumps({"correct_count": 0, "incorrect_count": 0, "percent_correct": 0.0,
+                           "answers": []}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _synthetic_photo() -> bytes:
+    """Foto de prueba de ~12 MP con ruido (similar en peso a una foto de celular)."""
+    import os
+    img = Image.frombytes("RGB", (4000, 3000), os.urandom(4000 * 3000 * 3))
+    img = Image.blend(img, Image.new("RGB", img.size, (235, 235, 225)), 0.7)
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=95)
+    return buf.getvalue()
+
+
+def bench(paths: list, mbps: float = None, settings: dict = None) -> list:
+    """
+    Envía cada archivo al webhook local sin procesar y procesado.
+    Devuelve bytes y latencia de punta a punta (preprocesado + POST) de cada caso.
+    """
+    import requests
+
+    _StandInWebhook.bytes_per_sec = (mbps * 1_000_000 / 8) if mbps else None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInWebhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/webhook"
+
+    if paths:
+        samples = [(Path(p).name, Path(p).read_bytes()) for p in paths]
+    else:
+        samples = [("sintetica.jpg", _synthetic_photo())]
+
+    rows = []
+    try:
+        for name, raw in samples:
+            mime = "image/png" if name.lower().endswith(".png") else (
+                "application/pdf" if name.lower().endswith(".pdf") else "image/jpeg")
+            for label, enabled in (("original", False), ("preprocesado", True)):
+                t0 = perf_counter()
+                data, out_mime, out_name = preprocess_exam_file(
+                    raw, mime, name, {**(settings or {}), "enabled": enabled})
+                t_prep = perf_counter() - t0
+                requests.post(url, data={"exam_id": "bench"},
+                              files={"exam_file": (out_name, data, out_mime)}, timeout=300)
+                total = perf_counter() - t0
+                rows.append({"archivo": name, "modo": label, "bytes": len(data),
+                             "preprocesado (ms)": round(t_prep * 1000, 1),
+                             "total (ms)": round(total * 1000, 1)})
+    finally:
+        server.shutdown()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocesado de hojas de respuesta antes del webhook.")
+    parser.add_argument("--bench", nargs="*", metavar="ARCHIVO",
+                        help="Compara bytes y latencia (sin archivos usa una foto sintética)")
+    parser.add_argument("--mbps", type=float, default=None,
+                        help="Ancho de banda simulado del webhook local (Mbit/s)")
+    parser.add_argument("--dpi", type=int, default=UPLOAD_SETTINGS["target_dpi"])
+    parser.add_argument("--max-bytes", type=int, default=UPLOAD_SETTINGS["max_bytes"])
+    parser.add_argument("--color", action="store_true", help="No convertir a escala de grises")
+    args = parser.parse_args()
+
+    if args.bench is None:
+        parser.print_help()
+        return
+    settings = {"target_dpi": args.dpi, "max_bytes": args.max_bytes, "grayscale": not args.color}
+    for r in bench(args.bench, args.mbps, settings):
+        print(f"  {r['archivo']:<24} {r['modo']:<13} {r['bytes']:>11,} B "
+              f"prep {r['preprocesado (ms)']:>8} ms  total {r['total (ms)']:>8} ms")
+
+
+if __name__ == "__main__":
+    main()